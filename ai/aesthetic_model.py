@@ -4,6 +4,8 @@ import torchvision.transforms as transforms
 from torchvision.models import resnet18
 import numpy as np
 from PIL import Image, ImageStat
+from metrics import stage
+from model_optimizer import optimize_model
 
 class AestheticModel(nn.Module):
     def __init__(self):
@@ -24,6 +26,8 @@ class AestheticModel(nn.Module):
 class AestheticAnalyzer:
     def __init__(self):
         self.model = AestheticModel()
+        self.model, report = optimize_model(self.model, "aesthetic_model", torch.randn(1, 3, 224, 224))
+        self.optimizations = {"aesthetic_model": report}
         self.transform = transforms.Compose([
             transforms.Resize((224, 224)),
             transforms.Lambda(lambda x: x.convert('RGB')), 
@@ -68,7 +72,7 @@ class AestheticAnalyzer:
         try:
             img_tensor = self.transform(image).unsqueeze(0)
             
-            with torch.no_grad():
+            with torch.no_grad(), stage("aesthetic_model", image):
                 score = self.model(img_tensor)
                 score = float(torch.sigmoid(score) * 10)
             
@@ -5,12 +5,54 @@ import torchvision.models as models
 from PIL import Image, ImageEnhance, ImageOps, ImageFilter
 import numpy as np
 import cv2
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from metrics import stage, stage_prefix
+
+SHARPEN_KERNEL = np.array([[-1,-1,-1],
+                           [-1, 9,-1],
+                           [-1,-1,-1]], dtype=np.float32) / 9
+
+# ITU-R 601-2 luma, as used by PIL's convert('L')
+LUMA_WEIGHTS = np.array([[0.299, 0.587, 0.114]], dtype=np.float32)
+
+# Tiled mode halos, in output pixels. The recursive edge-preserving filters in
+# _increase_resolution have unbounded support that decays over ~sigma_s
+# (60 and 20), so their tiles get a wide halo and a feathered seam. The
+# fused stages use finite kernels, so their halos make tiles exact:
+# details (7x7) + sharpen (3x3) need 4, UnsharpMask (sigma 2 -> 17x17) needs 8.
+UPSCALE_TILE_HALO = 128
+UPSCALE_SEAM = 16
+DETAIL_TILE_HALO = 4
+UNSHARP_TILE_HALO = 8
+
+# Preview mode: long side of the proxy the enhancement is computed on, and the
+# guided-filter window radius / regulariser used to transfer it to full size
+PREVIEW_PROXY_SIZE = 512
+PREVIEW_RADIUS = 4
+PREVIEW_EPS = 1e-3
 
 class AIImageEnhancer:
-    def __init__(self):
+    def __init__(self, fused=True, tile_size=1024, tile_threshold_mp=8, tile_workers=None):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.enhancement_model = self._load_enhancement_model()
-        
+        self._enhancement_model = None
+        # fused=False runs the original PIL step-by-step chain, kept as the
+        # reference the fused float32 pipeline is checked against
+        self.fused = fused
+        # Outputs above tile_threshold_mp megapixels are processed in
+        # tile_size tiles on a thread pool so memory is bounded by tile size
+        self.tile_size = tile_size
+        self.tile_threshold_mp = tile_threshold_mp
+        self.tile_workers = tile_workers or os.cpu_count() or 1
+
+    @property
+    def enhancement_model(self):
+        # enhance() is pure OpenCV/PIL work, so VGG16 is only loaded when a
+        # caller actually asks for it (batch workers would otherwise each load it)
+        if self._enhancement_model is None:
+            self._enhancement_model = self._load_enhancement_model()
+        return self._enhancement_model
+
     def _load_enhancement_model(self):
         model = models.vgg16(pretrained=True).features[:23].eval().to(self.device)
         for param in model.parameters():
@@ -61,6 +103,10 @@ class AIImageEnhancer:
 
     def _increase_resolution(self, img, scale_factor=2.0):
         """Increase image resolution with detail preservation"""
+        return Image.fromarray(self._increase_resolution_array(img, scale_factor))
+
+    def _increase_resolution_array(self, img, scale_factor=2.0):
+        """_increase_resolution returning the uint8 array instead of a PIL image"""
         # Calculate new dimensions
         width, height = img.size
         new_width = int(width * scale_factor)
@@ -84,52 +130,404 @@ class AIImageEnhancer:
                                           sigma_r=0.15)
         
         # Apply sharpening
-        kernel = np.array([[-1,-1,-1],
-                          [-1, 9,-1],
-                          [-1,-1,-1]]) / 9
-        sharpened = cv2.filter2D(detail_enhanced, -1, kernel)
-        
-        return Image.fromarray(sharpened)
+        return cv2.filter2D(detail_enhanced, -1, SHARPEN_KERNEL)
 
-    def enhance(self, image, strength=1.0, preserve_tone=True, upscale=True):
+    def enhance(self, image, strength=1.0, preserve_tone=True, upscale=True, tiled=None, mode="full"):
         """
         Enhanced version with resolution upscaling
+
+        tiled=None picks the tiled mode automatically for large outputs.
+        mode="preview" returns a fast approximation at the input resolution.
         """
-        image = image.convert('RGB')
-        original = image.copy()
-        
-        # Determine if upscaling is needed
+        if mode == "preview":
+            return self._enhance_preview(image, strength, preserve_tone)
+        if mode != "full":
+            raise ValueError(f"Unknown enhancement mode: {mode}")
+
+        if not self.fused:
+            return self._enhance_reference(image, strength, preserve_tone, upscale)
+
+        if tiled is None:
+            scale_factor = self._upscale_factor(image, upscale) or 1.0
+            output_mp = image.size[0] * image.size[1] * scale_factor ** 2 / 1e6
+            tiled = output_mp > self.tile_threshold_mp
+        if tiled:
+            return self._enhance_tiled(image, strength, preserve_tone, upscale)
+        return self._enhance_fused(image, strength, preserve_tone, upscale)
+
+    def _upscale_factor(self, image, upscale):
+        """Scale factor bringing the short side towards 1500px, or None"""
         min_dimension = 1500  # Minimum target dimension
         current_min_dim = min(image.size)
-        
         if upscale and current_min_dim < min_dimension:
-            # Calculate scale factor
             scale_factor = min(min_dimension / current_min_dim, 2.0)
             if scale_factor > 1.2:  # Only upscale if significant
+                return scale_factor
+        return None
+
+    def _enhance_fused(self, image, strength=1.0, preserve_tone=True, upscale=True):
+        """
+        Same chain as _enhance_reference on a single float32 buffer.
+
+        The PIL ImageEnhance and UnsharpMask steps are reproduced arithmetically
+        so the whole chain runs in place on `buf` with two preallocated scratch
+        buffers, instead of a PIL/numpy round trip and a fresh full-size image
+        per step. Output matches the reference within a few levels per channel.
+        """
+        image = image.convert('RGB')
+
+        scale_factor = self._upscale_factor(image, upscale)
+        if scale_factor is not None:
+            with stage("increase_resolution", image):
+                original = self._increase_resolution_array(image, scale_factor)
+        else:
+            original = np.asarray(image)
+
+        # CLAHE needs uint8; everything after it works on one float32 buffer
+        with stage("enhance_colors", original):
+            buf = self._enhance_colors_array(original).astype(np.float32)
+        scratch = np.empty_like(buf)
+        acc = np.empty_like(buf)
+
+        with stage("enhance_details", original):
+            self._enhance_details_inplace(buf, scratch, acc)
+        with stage("smart_sharpen", original):
+            self._apply_smart_sharpen_inplace(buf, scratch)
+        with stage("color_adjustments", original):
+            self._adjust_color_inplace(buf, acc)
+            self._adjust_contrast_brightness_inplace(buf, self._luma_mean(buf))
+        with stage("unsharp_mask", original):
+            self._unsharp_mask_inplace(buf, scratch, acc)
+
+        if preserve_tone:
+            with stage("blend", original):
+                blend_factor = min(max(strength * 0.8, 0.3), 0.9)
+                result = cv2.addWeighted(buf, blend_factor, original.astype(np.float32),
+                                         1 - blend_factor, 0, dtype=cv2.CV_8U)
+        else:
+            result = cv2.convertScaleAbs(buf)
+
+        return Image.fromarray(result)
+
+    def _enhance_colors_array(self, img_np):
+        """_enhance_colors on a uint8 RGB array, without the PIL round trip"""
+        lab = cv2.cvtColor(img_np, cv2.COLOR_RGB2LAB)
+        l, a, b = cv2.split(lab)
+
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        l = clahe.apply(l)
+
+        a = cv2.normalize(a, None, 0, 255, cv2.NORM_MINMAX)
+        b = cv2.normalize(b, None, 0, 255, cv2.NORM_MINMAX)
+        cv2.merge((l, a, b), dst=lab)
+        return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+    def _enhance_details_inplace(self, buf, scratch, acc):
+        """buf += 0.5 * sum(w * (buf - blur_w)), with the blurs accumulated into acc"""
+        # The weights sum to 1, so the detail term is buf - sum(w * blur)
+        cv2.GaussianBlur(buf, (3, 3), 0, dst=scratch)
+        np.multiply(scratch, 0.5, out=acc)
+        cv2.GaussianBlur(buf, (5, 5), 0, dst=scratch)
+        cv2.scaleAdd(scratch, 0.3, acc, dst=acc)
+        cv2.GaussianBlur(buf, (7, 7), 0, dst=scratch)
+        cv2.scaleAdd(scratch, 0.2, acc, dst=acc)
+
+        cv2.addWeighted(buf, 1.5, acc, -0.5, 0, dst=buf)
+        np.clip(buf, 0, 255, out=buf)
+        # The reference truncates to uint8 here; without it the output drifts brighter
+        np.floor(buf, out=buf)
+
+    def _apply_smart_sharpen_inplace(self, buf, scratch):
+        cv2.filter2D(buf, -1, SHARPEN_KERNEL, dst=scratch)
+        # filter2D on uint8 saturates, so clip before mixing like the reference
+        np.clip(scratch, 0, 255, out=scratch)
+        cv2.addWeighted(buf, 0.7, scratch, 0.3, 0, dst=buf)
+        np.rint(buf, out=buf)
+
+    def _adjust_color_inplace(self, buf, acc):
+        """ImageEnhance Color(1.2)"""
+        height, width = buf.shape[:2]
+
+        # Color: blend away from the luma image, x + 0.2 * (x - gray)
+        gray = acc.reshape(-1)[:height * width].reshape(height, width)
+        cv2.transform(buf, LUMA_WEIGHTS, dst=gray)
+        gray *= 0.2
+        buf *= 1.2
+        np.subtract(buf, gray[..., None], out=buf)
+        np.clip(buf, 0, 255, out=buf)
+        np.floor(buf, out=buf)  # PIL's blend truncates
+
+    def _luma_mean(self, img):
+        """Mean luma, rounded like ImageEnhance.Contrast"""
+        # Luma is linear, so it comes from the per-channel means instead of a gray image
+        channel_means = cv2.mean(img)[:3]
+        return int(float(np.dot(LUMA_WEIGHTS[0], channel_means)) + 0.5)
+
+    def _adjust_contrast_brightness_inplace(self, buf, mean):
+        """ImageEnhance Contrast(1.1) towards the mean luma, then Brightness(1.05)"""
+        buf *= 1.1
+        buf -= 0.1 * mean
+        np.clip(buf, 0, 255, out=buf)
+        np.floor(buf, out=buf)
+
+        # Brightness: blend away from black
+        buf *= 1.05
+        np.clip(buf, 0, 255, out=buf)
+        np.floor(buf, out=buf)
+
+    def _unsharp_mask_inplace(self, buf, scratch, acc, radius=2, percent=150, threshold=3):
+        """ImageFilter.UnsharpMask: add the high-pass where it reaches the threshold"""
+        cv2.GaussianBlur(buf, (0, 0), radius, dst=scratch)
+        np.subtract(buf, scratch, out=scratch)
+        np.abs(scratch, out=acc)
+        np.copyto(scratch, 0, where=acc < threshold)
+        cv2.scaleAdd(scratch, percent / 100, buf, dst=buf)
+        np.clip(buf, 0, 255, out=buf)
+
+    def _enhance_preview(self, image, strength=1.0, preserve_tone=True):
+        """
+        Enhance a downscaled proxy, then carry the result to full resolution.
+
+        Per channel, a guided filter fits a local affine transform
+        out = a * in + b on the proxy; a and b are smooth, so they are
+        upsampled bilinearly and applied to the full-resolution input.
+        No upscaling is done; the preview keeps the input size.
+        """
+        image = image.convert('RGB')
+        full = np.asarray(image)
+        height, width = full.shape[:2]
+
+        scale = PREVIEW_PROXY_SIZE / max(height, width)
+        if scale >= 1:
+            with stage_prefix("preview_"):
+                return self.enhance(image, strength, preserve_tone, upscale=False, tiled=False)
+
+        with stage("preview_proxy", full):
+            proxy_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            proxy_in = cv2.resize(full, proxy_size, interpolation=cv2.INTER_AREA)
+            # The proxy's own stages are recorded as preview_<stage>, not as full-size runs
+            with stage_prefix("preview_"):
+                proxy_out = np.asarray(self.enhance(Image.fromarray(proxy_in), strength, preserve_tone,
+                                                    upscale=False, tiled=False))
+
+        with stage("preview_upsample", full):
+            guide = proxy_in.astype(np.float32) / 255
+            target = proxy_out.astype(np.float32) / 255
+            window = (2 * PREVIEW_RADIUS + 1, 2 * PREVIEW_RADIUS + 1)
+
+            mean_guide = cv2.boxFilter(guide, -1, window)
+            mean_target = cv2.boxFilter(target, -1, window)
+            covariance = cv2.boxFilter(guide * target, -1, window) - mean_guide * mean_target
+            variance = cv2.boxFilter(guide * guide, -1, window) - mean_guide * mean_guide
+
+            a = covariance / (variance + PREVIEW_EPS)
+            b = mean_target - a * mean_guide
+            a = cv2.boxFilter(a, -1, window)
+            b = cv2.boxFilter(b, -1, window)
+
+            # Upsample the transform, not the image, so full-resolution detail survives
+            a = cv2.resize(a, (width, height), interpolation=cv2.INTER_LINEAR)
+            b = cv2.resize(b, (width, height), interpolation=cv2.INTER_LINEAR)
+            a *= full
+            a += b * 255
+            return Image.fromarray(cv2.convertScaleAbs(a))
+
+    def _enhance_tiled(self, image, strength=1.0, preserve_tone=True, upscale=True):
+        """
+        _enhance_fused over overlapping tiles on a thread pool.
+
+        Full-frame buffers are uint8 only (the upscaled original, which is also
+        the output, plus one intermediate); float32 work happens per tile.
+        CLAHE and the contrast mean are global, so they run between the two
+        tile passes.
+        """
+        image = image.convert('RGB')
+
+        with ThreadPoolExecutor(max_workers=self.tile_workers, thread_name_prefix="enhance-tile") as pool:
+            scale_factor = self._upscale_factor(image, upscale)
+            if scale_factor is not None:
+                with stage("increase_resolution", image):
+                    original = self._increase_resolution_tiled(image, scale_factor, pool)
+            else:
+                # Writable copy: the second pass stores the result in place
+                original = np.array(image)
+
+            with stage("enhance_colors", original):
+                colors = self._enhance_colors_array(original)
+
+            # Pass 1: details, sharpen and colour saturation into a uint8 intermediate
+            intermediate = np.empty_like(colors)
+
+            def detail_tile(core):
+                region, inner = self._tile_region(core, colors.shape, DETAIL_TILE_HALO)
+                buf = colors[region].astype(np.float32)
+                scratch = np.empty_like(buf)
+                acc = np.empty_like(buf)
+                self._enhance_details_inplace(buf, scratch, acc)
+                self._apply_smart_sharpen_inplace(buf, scratch)
+                self._adjust_color_inplace(buf, acc)
+                intermediate[core] = buf[inner]
+
+            with stage("tiled_details_sharpen_color", original):
+                for _ in self._map_tiles(pool, self._tile_grid(colors.shape), detail_tile):
+                    pass
+            # Rebound rather than deleted: detail_tile's closure still names it
+            colors = None
+
+            # Pass 2: contrast/brightness, UnsharpMask and the tone blend,
+            # written over the original one tile at a time
+            mean = self._luma_mean(intermediate)
+            blend_factor = min(max(strength * 0.8, 0.3), 0.9)
+
+            def tone_tile(core):
+                region, inner = self._tile_region(core, intermediate.shape, UNSHARP_TILE_HALO)
+                buf = intermediate[region].astype(np.float32)
+                scratch = np.empty_like(buf)
+                acc = np.empty_like(buf)
+                self._adjust_contrast_brightness_inplace(buf, mean)
+                self._unsharp_mask_inplace(buf, scratch, acc)
+                if preserve_tone:
+                    original[core] = cv2.addWeighted(buf[inner], blend_factor, original[core],
+                                                     1 - blend_factor, 0, dtype=cv2.CV_8U)
+                else:
+                    original[core] = cv2.convertScaleAbs(buf[inner])
+
+            with stage("tiled_contrast_unsharp_blend", original):
+                for _ in self._map_tiles(pool, self._tile_grid(intermediate.shape), tone_tile):
+                    pass
+
+        return Image.fromarray(original)
+
+    def _increase_resolution_tiled(self, img, scale_factor, pool):
+        """_increase_resolution computed per tile, with feathered seams"""
+        width, height = img.size
+        new_width = int(width * scale_factor)
+        new_height = int(height * scale_factor)
+        scale_x = new_width / width
+        scale_y = new_height / height
+        shape = (new_height, new_width, 3)
+
+        def upscale_tile(core):
+            # Output area: the core plus the seam band shared with neighbours
+            blended, _ = self._tile_region(core, shape, UPSCALE_SEAM)
+            region, inner = self._tile_region(blended, shape, UPSCALE_TILE_HALO)
+            ys, xs = region
+            # PIL resamples a box of the source at the same pixel centres as
+            # the full-frame resize, reading past the box as needed
+            box = (xs.start / scale_x, ys.start / scale_y, xs.stop / scale_x, ys.stop / scale_y)
+            tile = np.asarray(img.resize((xs.stop - xs.start, ys.stop - ys.start), Image.LANCZOS, box=box))
+
+            tile = cv2.edgePreservingFilter(tile, flags=cv2.RECURS_FILTER, sigma_s=60, sigma_r=0.4)
+            tile = cv2.detailEnhance(tile, sigma_s=20, sigma_r=0.15)
+            tile = cv2.filter2D(tile, -1, SHARPEN_KERNEL)
+            return core, blended, tile[inner]
+
+        # Weights ramp linearly across each seam band and sum to one, so
+        # tiles can be accumulated in whatever order they finish
+        result = np.zeros(shape, dtype=np.uint8)
+        for core, blended, tile in self._map_tiles(pool, self._tile_grid(shape), upscale_tile):
+            weight = self._seam_weights(core, blended, shape)
+            if weight is None:
+                result[blended] = tile
+                continue
+            accumulated = result[blended].astype(np.float32)
+            accumulated += weight[..., None] * tile
+            np.rint(accumulated, out=accumulated)
+            result[blended] = np.clip(accumulated, 0, 255)
+
+        return result
+
+    def _tile_grid(self, shape):
+        """Split an image into roughly equal tile cores of at most tile_size"""
+        height, width = shape[:2]
+        rows = -(-height // self.tile_size)
+        cols = -(-width // self.tile_size)
+        ys = [round(i * height / rows) for i in range(rows + 1)]
+        xs = [round(i * width / cols) for i in range(cols + 1)]
+        return [(slice(ys[r], ys[r + 1]), slice(xs[c], xs[c + 1]))
+                for r in range(rows) for c in range(cols)]
+
+    def _tile_region(self, core, shape, halo):
+        """Core grown by halo (clipped to the image), and the core's slice within it"""
+        height, width = shape[:2]
+        ys, xs = core
+        y0, y1 = max(0, ys.start - halo), min(height, ys.stop + halo)
+        x0, x1 = max(0, xs.start - halo), min(width, xs.stop + halo)
+        region = (slice(y0, y1), slice(x0, x1))
+        inner = (slice(ys.start - y0, ys.stop - y0), slice(xs.start - x0, xs.stop - x0))
+        return region, inner
+
+    def _seam_weights(self, core, blended, shape):
+        """Feather weights over the blended area, or None when it has no seams"""
+        height, width = shape[:2]
+
+        def ramp(core_slice, area_slice, size):
+            positions = np.arange(area_slice.start, area_slice.stop, dtype=np.float32) + 0.5
+            weights = np.ones_like(positions)
+            if core_slice.start > 0:
+                weights = np.minimum(weights, (positions - (core_slice.start - UPSCALE_SEAM)) / (2 * UPSCALE_SEAM))
+            if core_slice.stop < size:
+                weights = np.minimum(weights, ((core_slice.stop + UPSCALE_SEAM) - positions) / (2 * UPSCALE_SEAM))
+            return np.clip(weights, 0, 1)
+
+        wy = ramp(core[0], blended[0], height)
+        wx = ramp(core[1], blended[1], width)
+        if wy.min() == 1 and wx.min() == 1:
+            return None
+        return np.outer(wy, wx)
+
+    def _map_tiles(self, pool, cores, fn):
+        """Run fn over the tiles, keeping at most two tiles per worker in flight"""
+        window = 2 * self.tile_workers
+        pending = set()
+        for core in cores:
+            pending.add(pool.submit(fn, core))
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+    def _enhance_reference(self, image, strength=1.0, preserve_tone=True, upscale=True):
+        """Original step-by-step PIL chain"""
+        image = image.convert('RGB')
+        original = image.copy()
+        
+        # Determine if upscaling is needed
+        scale_factor = self._upscale_factor(image, upscale)
+        if scale_factor is not None:
+            with stage("increase_resolution", image):
                 image = self._increase_resolution(image, scale_factor)
-                original = image.copy()  # Update original for later blending
+            original = image.copy()  # Update original for later blending
         
         # Apply regular enhancements
-        enhanced = self._enhance_colors(image)
-        enhanced = self._enhance_details(enhanced)
-        enhanced = self._apply_smart_sharpen(enhanced)
+        with stage("enhance_colors", image):
+            enhanced = self._enhance_colors(image)
+        with stage("enhance_details", image):
+            enhanced = self._enhance_details(enhanced)
+        with stage("smart_sharpen", image):
+            enhanced = self._apply_smart_sharpen(enhanced)
         
         # Color adjustments
-        enhancer = ImageEnhance.Color(enhanced)
-        enhanced = enhancer.enhance(1.2)
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(1.1)
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(1.05)
+        with stage("color_adjustments", image):
+            enhancer = ImageEnhance.Color(enhanced)
+            enhanced = enhancer.enhance(1.2)
+            enhancer = ImageEnhance.Contrast(enhanced)
+            enhanced = enhancer.enhance(1.1)
+            enhancer = ImageEnhance.Brightness(enhanced)
+            enhanced = enhancer.enhance(1.05)
         
         # Final sharpening
-        enhanced = enhanced.filter(
-            ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3)
-        )
+        with stage("unsharp_mask", image):
+            enhanced = enhanced.filter(
+                ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3)
+            )
         
         # Tone preservation
         if preserve_tone:
-            blend_factor = min(max(strength * 0.8, 0.3), 0.9)
-            enhanced = Image.blend(original, enhanced, blend_factor)
+            with stage("blend", image):
+                blend_factor = min(max(strength * 0.8, 0.3), 0.9)
+                enhanced = Image.blend(original, enhanced, blend_factor)
         
         return enhanced
@@ -1,14 +1,20 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
-from PIL import Image, ImageEnhance
+from PIL import Image
 import os
 import time
-from aesthetic_model import AestheticAnalyzer
-from style_transfer import VanGoghStyleTransfer
+import json
 import logging
-from background_editor import BackgroundEditor
-from face_enhancer import FaceEnhancer
-from ai_enhancement import AIImageEnhancer
+import multiprocessing
+import metrics
+from model_registry import ModelRegistry, warmup_names_from_env
+from job_queue import Job, JobQueue, QueueFull, DONE, FAILED, CANCELLED
+from result_cache import ResultCache
+from batch_enhance import BatchEnhancer, collect_inputs
+from style_library import DEFAULT_STYLE, discover_styles, style_hash
+from micro_batcher import MicroBatcher
+from face_anonymizer import MODES as ANONYMIZE_MODES
+from utils.image_io import read_upload, output_format, encode_image
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,107 +22,530 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "outputs"
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# "path" writes results to OUTPUT_FOLDER and returns their name (the client
+# then fetches /outputs/<filename>); "inline" returns the encoded bytes.
+# Can be overridden per request with ?response=inline|path.
+RESPONSE_MODE = os.environ.get("RESPONSE_MODE", "path")
+
+# Longest a GET /jobs/<id>?wait=N long-poll may block
+MAX_JOB_WAIT = 60
+
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Initialize the aesthetic analyzer
-# analyzer = AestheticAnalyzer()
+# Engines are built on first use; WARMUP_MODELS selects the ones to load
+# in a background thread at startup so the port binds immediately.
+models = ModelRegistry()
+# Spawned batch workers re-import this module; only the server process warms up
+if multiprocessing.parent_process() is None:
+    models.warm_up(warmup_names_from_env())
 
-# Initialize the style transfer model
-style_transfer = VanGoghStyleTransfer()
+# Every image transform runs on this bounded pool, both for /jobs and for the
+# synchronous routes, so concurrency is capped the same way for both.
+jobs = JobQueue(
+    max_workers=int(os.environ.get("JOB_WORKERS", 2)),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", 32)),
+    ttl_seconds=int(os.environ.get("JOB_TTL_SECONDS", 600))
+)
 
-# Initialize the background editor
-# background_editor = BackgroundEditor()
+# Results keyed by a hash of the decoded input, the endpoint and its
+# parameters; CACHE_MEMORY_BYTES=0 and CACHE_DISK_BYTES=0 disable the tiers.
+cache = None
+if os.environ.get("CACHE_ENABLED", "true").lower() == "true":
+    cache = ResultCache(
+        os.path.join(OUTPUT_FOLDER, "cache"),
+        memory_bytes=int(os.environ.get("CACHE_MEMORY_BYTES", 256 * 1024 * 1024)),
+        disk_bytes=int(os.environ.get("CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+    )
 
-# Initialize the face enhancer
-# face_enhancer = FaceEnhancer()
+# /vangogh-style?mode=fast|quality -> engine; STYLE_MODE sets the default
+STYLE_ENGINES = {"fast": "fast_style_transfer", "quality": "style_transfer"}
+STYLE_MODE = os.environ.get("STYLE_MODE", "quality")
+# Upper bounds (and defaults) for the ?steps= and ?time_budget= overrides
+STYLE_MAX_STEPS = int(os.environ.get("STYLE_MAX_STEPS", 100))
+STYLE_MAX_SECONDS = float(os.environ.get("STYLE_MAX_SECONDS", 120))
+STYLE_TOLERANCE = float(os.environ.get("STYLE_TOLERANCE", 1e-3))
+# Multi-scale (?target_size=) output limit and refinement steps per scale
+STYLE_MAX_TARGET_SIZE = int(os.environ.get("STYLE_MAX_TARGET_SIZE", 4096))
+STYLE_REFINE_STEPS = int(os.environ.get("STYLE_REFINE_STEPS", 20))
+# Largest long side of the ?preview_every= JPEG previews streamed to /jobs/<id>/events
+STYLE_PREVIEW_MAX_SIZE = int(os.environ.get("STYLE_PREVIEW_MAX_SIZE", 320))
+# Seconds between keep-alive comments on an idle event stream
+EVENTS_KEEPALIVE_SECONDS = 15
 
-# Initialize AI enhancer
-ai_enhancer = AIImageEnhancer()
+def _run_style_batch(items):
+    """Optimise a micro-batch of "quality" style requests together"""
+    with metrics.route("vangogh-style"):
+        return models.get("style_transfer").transfer_style_batch(
+            [item["image"] for item in items],
+            styles=[item["style"] for item in items],
+            should_stop=[item["should_stop"] for item in items],
+            max_steps=[item["max_steps"] for item in items],
+            tolerance=[item["tolerance"] for item in items],
+            time_budget=[item["time_budget"] for item in items],
+            on_progress=[item["on_progress"] for item in items]
+        )
 
-@app.route("/auto-enhance", methods=["POST"])
-def auto_enhance_image():
+# "quality" style requests arriving within STYLE_BATCH_WINDOW_MS are optimised
+# as one batch of up to STYLE_BATCH_SIZE (bounded by JOB_WORKERS, since each
+# request holds a job worker while it waits); STYLE_BATCH_SIZE=1 disables it.
+style_batcher = None
+if int(os.environ.get("STYLE_BATCH_SIZE", 4)) > 1:
+    style_batcher = MicroBatcher(
+        _run_style_batch,
+        max_batch_size=int(os.environ.get("STYLE_BATCH_SIZE", 4)),
+        window_seconds=float(os.environ.get("STYLE_BATCH_WINDOW_MS", 50)) / 1000,
+        name="style-batcher"
+    )
+
+# Process pool for /auto-enhance/batch, sized to the machine by default
+batch_enhancer = BatchEnhancer(max_workers=int(os.environ.get("BATCH_WORKERS", 0)) or None)
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 200))
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    ready = models.is_ready()
+    return jsonify({
+        "status": "ready" if ready else "loading",
+        "engines": models.status()
+    }), 200 if ready else 503
+
+def _get_upload():
+    """Return the uploaded photo or an error response tuple"""
+    if "photo" not in request.files:
+        logger.error("No file provided in request")
+        return None, (jsonify({"error": "No file uploaded"}), 400)
+
+    file = request.files["photo"]
+    if not file.filename:
+        logger.error("Empty filename provided")
+        return None, (jsonify({"error": "Empty filename"}), 400)
+
+    return file, None
+
+def _encode_result(image, prefix, filename, fmt=None, quality=95, extra=None):
+    """Encode a processed image; runs on the worker so the request thread only sends bytes"""
+    fmt = fmt or output_format(filename)
+    return {
+        "data": encode_image(image, fmt, quality=quality),
+        "fmt": fmt,
+        "prefix": prefix,
+        "filename": os.path.basename(filename),
+        "extra": extra,
+        "output_filename": None,
+    }
+
+def _image_response(result):
+    """Return the result inline as bytes, or save it to OUTPUT_FOLDER and return its name"""
+    if request.args.get("response", RESPONSE_MODE).lower() == "inline":
+        response = Response(result["data"], mimetype=Image.MIME.get(result["fmt"], "application/octet-stream"))
+        if result["extra"]:
+            response.headers["X-Result-Info"] = json.dumps(result["extra"])
+        return response
+
+    # Job results can be fetched more than once; only write them the first time
+    if result["output_filename"] is None:
+        current_time = int(time.time() * 1000)
+        output_filename = f"{result['prefix']}_{current_time}_{result['filename']}"
+        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+        with open(output_path, "wb") as f:
+            f.write(result["data"])
+        logger.info(f"Saved result to {output_path}")
+        result["output_filename"] = output_filename
+
+    output_filename = result["output_filename"]
+    response = {
+        "processed_image": output_filename,
+        "full_path": os.path.join(OUTPUT_FOLDER, output_filename),
+        "status": "success"
+    }
+    if result["extra"]:
+        response.update(result["extra"])
+    return jsonify(response), 200
+
+def _with_cache(kind, image, params, filename, compute):
+    """Wrap a task so its encoded result is stored in the result cache"""
+    key = None
+    if cache is not None:
+        # The output encoding follows the upload's extension, so it is part of the key
+        params = dict(params, output_format=output_format(filename))
+        key = ResultCache.make_key(kind, image, params)
+
+    def task(job):
+        with metrics.route(kind), metrics.stage("total", image):
+            result = compute(job)
+        # Results stopped early by the client don't match their parameters
+        if key is not None and not job.should_stop():
+            cache.put(key, result["data"], {
+                "fmt": result["fmt"],
+                "prefix": result["prefix"],
+                "extra": result["extra"]
+            })
+        return result
+
+    task.cache_key = key
+    task.filename = filename
+    return task
+
+def _lookup_cache(task):
+    """Return a cached result for the task without touching the models, or None"""
+    if getattr(task, "cache_key", None) is None:
+        return None
+
+    entry = cache.get(task.cache_key)
+    if entry is None:
+        return None
+
+    data, meta = entry
+    logger.info(f"Result cache hit for {task.cache_key}")
+    return {
+        "data": data,
+        "fmt": meta["fmt"],
+        "prefix": meta["prefix"],
+        "filename": os.path.basename(task.filename),
+        "extra": meta["extra"],
+        "output_filename": None,
+    }
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Per-route, per-stage histograms plus queue, cache and engine state"""
+    extra = {}
+    peak = metrics.peak_rss_bytes()
+    if peak is not None:
+        extra["fotominds_process_peak_rss_bytes"] = ("gauge", "Process lifetime peak RSS", peak)
+    for status, count in jobs.counts().items():
+        extra[f"fotominds_jobs_{status}"] = ("gauge", f"Jobs currently {status}", count)
+    for name, state in models.status().items():
+        extra[f"fotominds_engine_loaded_{name}"] = ("gauge", f"Whether {name} is loaded", int(state["loaded"]))
+    if cache is not None:
+        for name, value in cache.stats().items():
+            metric_type = "gauge" if name.endswith(("entries", "bytes", "budget")) else "counter"
+            suffix = "_total" if metric_type == "counter" else ""
+            extra[f"fotominds_cache_{name}{suffix}"] = (metric_type, f"Result cache {name.replace('_', ' ')}", value)
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    if cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(cache.stats(), enabled=True)), 200
+
+@app.route("/styles", methods=["GET"])
+def list_styles():
+    """Styles available to /vangogh-style, and whether each has fast weights"""
+    fast_styles = set(models.get("fast_style_transfer").available_styles())
+    styles = [{"name": name, "fast": name in fast_styles} for name in discover_styles()]
+    return jsonify({"styles": styles, "default": DEFAULT_STYLE}), 200
+
+def _enhance_params(args, defaults=None):
+    """Read strength/preserve_tone/quality from a mapping, falling back to defaults"""
+    defaults = defaults or {"strength": 1.0, "preserve_tone": True, "quality": 95}
+    preserve_tone = args.get('preserve_tone', defaults["preserve_tone"])
+    if isinstance(preserve_tone, str):
+        preserve_tone = preserve_tone.lower() == 'true'
+    return {
+        "strength": float(args.get('strength', defaults["strength"])),
+        "preserve_tone": bool(preserve_tone),
+        "quality": int(args.get('quality', defaults["quality"]))
+    }
+
+def _parse_auto_enhance():
+    """Read the upload and enhancement parameters of an /auto-enhance request"""
+    file, error = _get_upload()
+    if error:
+        return None, error
+
+    # Get enhancement parameters from query string
+    params = _enhance_params(request.args)
+    mode = request.args.get('mode', 'full').lower()
+    if mode not in ('full', 'preview'):
+        return None, (jsonify({"error": f"Unknown mode: {mode}"}), 400)
+
+    # Basic image validation
     try:
-        logger.info("Starting auto-enhance process")
-        
-        # Validate request
-        if "photo" not in request.files:
-            logger.error("No file provided in request")
-            return jsonify({"error": "No file uploaded"}), 400
-        
-        file = request.files["photo"]
-        if not file.filename:
-            logger.error("Empty filename provided")
-            return jsonify({"error": "Empty filename"}), 400
-        
-        # Get enhancement parameters from query string
-        enhance_strength = float(request.args.get('strength', 1.0))
-        preserve_tone = request.args.get('preserve_tone', 'true').lower() == 'true'
-        quality = int(request.args.get('quality', 95)) 
-        
-        # Save and process image
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(file_path)
-        logger.info(f"Saved input file to {file_path}")
-        
-        # Basic image validation
-        try:
-            image = Image.open(file_path)
-            if image.format not in ['JPEG', 'PNG', 'WebP']:
-                raise ValueError("Unsupported image format")
-        except Exception as e:
-            logger.error(f"Invalid image file: {str(e)}")
-            return jsonify({"error": "Invalid image file"}), 400
-        
-        # Apply AI enhancement with parameters
-        logger.info("Applying AI enhancement with resolution improvement")
-        image = ai_enhancer.enhance(
+        image = read_upload(file)
+    except Exception as e:
+        logger.error(f"Invalid image file: {str(e)}")
+        return None, (jsonify({"error": "Invalid image file"}), 400)
+
+    return (image, file.filename, params, mode), None
+
+def _auto_enhance_task(image, filename, params, mode):
+    """Job task enhancing one image in "full" or "preview" mode"""
+    def compute(job):
+        logger.info(f"Applying AI enhancement ({mode})")
+        enhanced = models.get("ai_enhancer").enhance(
             image,
-            strength=enhance_strength,
-            preserve_tone=preserve_tone
+            strength=params["strength"],
+            preserve_tone=params["preserve_tone"],
+            mode=mode
         )
-        
-        # Save enhanced image with optimal settings
-        current_time = int(time.time() * 1000)
-        output_filename = f"enhanced_{current_time}_{file.filename}"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        
-        # Save with format-specific optimizations
-        if image.format == 'JPEG':
-            image.save(output_path, 
-                      'JPEG', 
-                      quality=quality, 
-                      optimize=True,
-                      subsampling=0)  # Better color sampling
-        elif image.format == 'PNG':
-            image.save(output_path, 
-                      'PNG',
-                      optimize=True,
-                      compress_level=6)  # Balanced compression
-        else:
-            image.save(output_path, quality=95, optimize=True)
-        
-        logger.info(f"Saved enhanced image to {output_path}")
-        
-        # Cleanup temporary file
-        try:
-            os.remove(file_path)
-        except Exception as e:
-            logger.warning(f"Failed to cleanup temporary file: {str(e)}")
-        
-        return jsonify({
-            "processed_image": output_path[8:],
-            "full_path": output_filename,
-            "status": "success",
+        return _encode_result(enhanced, "enhanced", filename, quality=params["quality"], extra={
             "parameters": {
-                "strength": enhance_strength,
-                "preserve_tone": preserve_tone
+                "strength": params["strength"],
+                "preserve_tone": params["preserve_tone"],
+                "mode": mode
             }
-        }), 200
-        
+        })
+
+    return _with_cache("auto-enhance", image, dict(params, mode=mode), filename, compute)
+
+def _prepare_auto_enhance():
+    """Parse an /auto-enhance request into a job task"""
+    parsed, error = _parse_auto_enhance()
+    if error:
+        return None, error
+    return _auto_enhance_task(*parsed), None
+
+def _run_progressive():
+    """Queue the full enhancement, then answer at once with a preview and the job ID"""
+    parsed, error = _parse_auto_enhance()
+    if error:
+        return error
+    image, filename, params, _ = parsed
+
+    full_task = _auto_enhance_task(image, filename, params, "full")
+    cached = _lookup_cache(full_task)
+    try:
+        full_job = jobs.submit_result("auto-enhance", cached) if cached else jobs.submit("auto-enhance", full_task)
+    except QueueFull as e:
+        logger.warning(str(e))
+        return jsonify({"error": "Server busy, try again later"}), 503
+
+    # The preview is cheap, so it runs on the request thread rather than
+    # queueing behind long jobs on the pool
+    preview_task = _auto_enhance_task(image, filename, params, "preview")
+    preview = _lookup_cache(preview_task) or preview_task(Job("auto-enhance"))
+    preview["extra"] = dict(preview["extra"] or {}, job_id=full_job.id)
+    return _image_response(preview)
+
+def _style_progress(job, original_size, preview_every, preview_size):
+    """on_progress callback publishing a style job's steps (and previews) to its event stream"""
+    width, height = original_size
+    scale = preview_size / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    def to_image(tensor):
+        return models.get("style_transfer").postprocess_image(tensor, size)
+
+    def on_progress(info, output):
+        job.progress.publish("progress", info)
+        if preview_every > 0 and info["step"] % preview_every == 0:
+            # Only the copy happens here; scaling and JPEG encoding run on the preview thread
+            job.progress.preview(output.detach().clone(), to_image, step=info["step"], scale=info.get("scale"))
+
+    return on_progress
+
+def _prepare_vangogh_style():
+    """Parse a /vangogh-style request into a job task"""
+    file, error = _get_upload()
+    if error:
+        return None, error
+
+    # "fast" is a single feed-forward pass, "quality" the per-image optimisation
+    mode = request.args.get('mode', STYLE_MODE).lower()
+    if mode not in STYLE_ENGINES:
+        return None, (jsonify({"error": f"Unknown style mode: {mode}"}), 400)
+
+    style = request.args.get('style', DEFAULT_STYLE)
+    styles = discover_styles()
+    if style not in styles:
+        return None, (jsonify({"error": f"Unknown style: {style}"}), 400)
+
+    if mode == "fast" and not models.get("fast_style_transfer").has_style(style):
+        return None, (jsonify({"error": f"Fast style weights are not installed for {style}"}), 503)
+
+    # Per-request optimisation budget for "quality", capped by the server limits
+    # The style image's hash keys the cache, so replacing it under the same name isn't served stale
+    params = {"mode": mode, "style": style, "style_hash": style_hash(styles[style])}
+    if mode == "quality":
+        params.update({
+            "max_steps": min(int(request.args.get('steps', STYLE_MAX_STEPS)), STYLE_MAX_STEPS),
+            "tolerance": float(request.args.get('tolerance', STYLE_TOLERANCE)),
+            "time_budget": min(float(request.args.get('time_budget', STYLE_MAX_SECONDS)), STYLE_MAX_SECONDS)
+        })
+        if params["time_budget"] <= 0:
+            return None, (jsonify({"error": "time_budget must be positive"}), 400)
+        # ?target_size=<long side px> switches to coarse-to-fine multi-scale output
+        if request.args.get('target_size'):
+            target_size = int(request.args['target_size'])
+            if not 0 < target_size <= STYLE_MAX_TARGET_SIZE:
+                return None, (jsonify({"error": f"target_size must be 1..{STYLE_MAX_TARGET_SIZE}"}), 400)
+            params["target_size"] = target_size
+
+    # Streaming options for /jobs/<id>/events; they don't change the result
+    preview_every = int(request.args.get('preview_every', 0))
+    preview_size = min(int(request.args.get('preview_size', 160)), STYLE_PREVIEW_MAX_SIZE)
+
+    filename = file.filename
+    image = read_upload(file, formats=None)
+
+    def compute(job):
+        logger.info(f"Starting style transfer ({mode})")
+        extra = {"mode": mode, "style": style}
+        on_progress = _style_progress(job, image.size, preview_every, preview_size) if mode == "quality" else None
+        if mode == "quality" and "target_size" in params:
+            stylized_image, stats = models.get("style_transfer").transfer_style_multiscale(
+                image,
+                target_size=params["target_size"],
+                style=style,
+                should_stop=job.should_stop,
+                max_steps=params["max_steps"],
+                tolerance=params["tolerance"],
+                time_budget=params["time_budget"],
+                refine_steps=STYLE_REFINE_STEPS,
+                return_stats=True,
+                on_progress=on_progress
+            )
+            extra.update(stats)
+        elif mode == "quality" and style_batcher is not None:
+            stylized_image, stats = style_batcher.submit(dict(
+                params,
+                image=image,
+                should_stop=job.should_stop,
+                on_progress=on_progress
+            ))
+            extra.update(stats)
+        elif mode == "quality":
+            stylized_image, stats = models.get("style_transfer").transfer_style(
+                image,
+                style=style,
+                should_stop=job.should_stop,
+                max_steps=params["max_steps"],
+                tolerance=params["tolerance"],
+                time_budget=params["time_budget"],
+                return_stats=True,
+                on_progress=on_progress
+            )
+            extra.update(stats)
+        else:
+            stylized_image = models.get(STYLE_ENGINES[mode]).transfer_style(
+                image, style=style, should_stop=job.cancelled)
+        if job.stopping():
+            extra["stopped"] = "stopped_early"
+        logger.info("Style transfer completed")
+        return _encode_result(stylized_image, "vangogh", filename, extra=extra)
+
+    return _with_cache("vangogh-style", image, params, filename, compute), None
+
+def _prepare_remove_background():
+    """Parse a /remove-background request into a job task"""
+    file, error = _get_upload()
+    if error:
+        return None, error
+
+    filename = file.filename
+    image = read_upload(file, mode='RGBA', formats=None)
+
+    def compute(job):
+        processed_image = models.get("background_editor").remove_background(image)
+        return _encode_result(processed_image, "nobg", filename, fmt='PNG')
+
+    return _with_cache("remove-background", image, {}, filename, compute), None
+
+def _prepare_replace_background():
+    """Parse a /replace-background request into a job task"""
+    if "photo" not in request.files:
+        return None, (jsonify({"error": "No file uploaded"}), 400)
+
+    background_path = request.form.get("background")
+    if not background_path:
+        return None, (jsonify({"error": "No background path provided"}), 400)
+
+    background_name = os.path.basename(background_path)
+    logger.info(f"Background name: {background_name}")
+
+    file, error = _get_upload()
+    if error:
+        return None, error
+
+    filename = file.filename
+    image = read_upload(file, mode='RGBA', formats=None)
+
+    def compute(job):
+        processed_image = models.get("background_editor").replace_background(image, background_name)
+        return _encode_result(processed_image, "newbg", filename, fmt='PNG')
+
+    params = {"background": background_name}
+    return _with_cache("replace-background", image, params, filename, compute), None
+
+def _prepare_enhance_face():
+    """Parse an /enhance-face request into a job task"""
+    file, error = _get_upload()
+    if error:
+        return None, error
+
+    filename = file.filename
+    image = read_upload(file, mode='RGB', formats=None)
+
+    def compute(job):
+        enhanced_image = models.get("face_enhancer").enhance_facial_features(image)
+        return _encode_result(enhanced_image, "enhanced_face", filename)
+
+    return _with_cache("enhance-face", image, {}, filename, compute), None
+
+def _prepare_anonymize_faces():
+    """Parse an /anonymize-faces request into a job task"""
+    file, error = _get_upload()
+    if error:
+        return None, error
+
+    mode = request.args.get('mode', 'blur').lower()
+    if mode not in ANONYMIZE_MODES:
+        return None, (jsonify({"error": f"Unknown anonymisation mode: {mode}"}), 400)
+
+    filename = file.filename
+    image = read_upload(file, mode='RGB', formats=None)
+
+    def compute(job):
+        anonymized_image, faces = models.get("face_anonymizer").anonymize(image, mode)
+        return _encode_result(anonymized_image, "anonymized", filename, extra={"mode": mode, "faces": faces})
+
+    return _with_cache("anonymize-faces", image, {"mode": mode}, filename, compute), None
+
+# Job kind -> request parser; the kind is also the synchronous route name
+JOB_KINDS = {
+    "auto-enhance": _prepare_auto_enhance,
+    "vangogh-style": _prepare_vangogh_style,
+    "remove-background": _prepare_remove_background,
+    "replace-background": _prepare_replace_background,
+    "enhance-face": _prepare_enhance_face,
+    "anonymize-faces": _prepare_anonymize_faces,
+}
+
+def _run_sync(kind):
+    """Run a job on the pool and wait for it, for the synchronous routes"""
+    task, error = JOB_KINDS[kind]()
+    if error:
+        return error
+
+    cached = _lookup_cache(task)
+    if cached is not None:
+        return _image_response(cached)
+
+    try:
+        job = jobs.submit(kind, task)
+    except QueueFull as e:
+        logger.warning(str(e))
+        return jsonify({"error": "Server busy, try again later"}), 503
+
+    job.wait()
+    if job.status == FAILED:
+        raise job.exception
+    if job.status == CANCELLED:
+        return jsonify({"error": "Job was cancelled"}), 409
+    return _image_response(job.result)
+
+@app.route("/auto-enhance", methods=["POST"])
+def auto_enhance_image():
+    try:
+        logger.info("Starting auto-enhance process")
+        if request.args.get('progressive', 'false').lower() == 'true':
+            return _run_progressive()
+        return _run_sync("auto-enhance")
+
     except Exception as e:
         logger.error(f"Error in auto-enhance: {str(e)}")
         return jsonify({
@@ -124,19 +553,75 @@ def auto_enhance_image():
             "details": str(e)
         }), 500
 
+@app.route("/auto-enhance/batch", methods=["POST"])
+def auto_enhance_batch():
+    """Enhance many photos (or a zip of them), streaming an NDJSON manifest as each finishes"""
+    try:
+        inputs = collect_inputs(request.files.getlist("photos"),
+                                archive=request.files.get("archive"),
+                                max_files=BATCH_MAX_FILES)
+        if not inputs:
+            return jsonify({"error": "No files uploaded"}), 400
+
+        # Shared parameters come from the query string; the optional "parameters"
+        # form field maps filenames to per-file overrides.
+        shared = _enhance_params(request.args)
+        overrides = json.loads(request.form.get("parameters", "{}"))
+    except Exception as e:
+        logger.error(f"Invalid batch request: {str(e)}")
+        return jsonify({"error": "Invalid batch request", "details": str(e)}), 400
+
+    def params_for(filename):
+        return _enhance_params(overrides.get(filename, {}), defaults=shared)
+
+    logger.info(f"Starting batch enhancement of {len(inputs)} images")
+
+    def generate():
+        succeeded = 0
+        batch_time = int(time.time() * 1000)
+        for index, filename, params, result, error in batch_enhancer.run(inputs, params_for):
+            entry = {"index": index, "filename": filename, "parameters": params}
+            if error is not None:
+                entry.update(status="error", error=error)
+            else:
+                data, fmt, seconds = result
+                # Stages run in the worker processes; only the per-image total is visible here
+                metrics.STAGE_SECONDS.observe(seconds, route="auto-enhance-batch", stage="total")
+                output_filename = f"enhanced_{batch_time}_{index}_{filename}"
+                output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+                with open(output_path, "wb") as f:
+                    f.write(data)
+                entry.update(status="success", processed_image=output_filename,
+                             full_path=output_path, seconds=seconds)
+                succeeded += 1
+            yield json.dumps(entry) + "\n"
+
+        yield json.dumps({
+            "status": "complete",
+            "total": len(inputs),
+            "succeeded": succeeded,
+            "failed": len(inputs) - succeeded
+        }) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
 @app.route("/analyze-aesthetic", methods=["POST"])
 def analyze_aesthetic():
     if "photo" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
-    
-    file = request.files["photo"]
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
-    image = Image.open(file_path)
-    composition_data = analyzer.analyze_composition(image)
-    exposure_data = analyzer.analyze_exposure(image)
-    aesthetic_score = analyzer.predict_score(image)
-    suggestions = analyzer.get_suggestions(composition_data, exposure_data)
+
+    try:
+        image = read_upload(request.files["photo"])
+    except Exception as e:
+        logger.error(f"Invalid image file: {str(e)}")
+        return jsonify({"error": "Invalid image file"}), 400
+
+    with metrics.route("analyze-aesthetic"), metrics.stage("total", image):
+        analyzer = models.get("aesthetic_analyzer")
+        composition_data = analyzer.analyze_composition(image)
+        exposure_data = analyzer.analyze_exposure(image)
+        aesthetic_score = analyzer.predict_score(image)
+        suggestions = analyzer.get_suggestions(composition_data, exposure_data)
 
     analysis_result = {
         "score": aesthetic_score,
@@ -151,36 +636,7 @@ def analyze_aesthetic():
 def apply_vangogh_style():
     try:
         logger.info("Received request for Van Gogh style transfer")
-        
-        if "photo" not in request.files:
-            logger.error("No file uploaded")
-            return jsonify({"error": "No file uploaded"}), 400
-        
-        file = request.files["photo"]
-        if not file.filename:
-            logger.error("Empty filename")
-            return jsonify({"error": "Empty filename"}), 400
-        
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(file_path)
-        logger.info(f"Saved input file to {file_path}")
-        image = Image.open(file_path)
-        logger.info("Starting style transfer")
-        
-        stylized_image = style_transfer.transfer_style(image)
-        logger.info("Style transfer completed")
-
-        current_time = int(time.time() * 1000)
-        output_filename = f"vangogh_{current_time}_{file.filename}"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        stylized_image.save(output_path)
-        logger.info(f"Saved stylized image to {output_path}")
-
-        return jsonify({
-            "processed_image": output_filename,
-            "full_path": output_path,
-            "status": "success"
-        }), 200
+        return _run_sync("vangogh-style")
 
     except Exception as e:
         logger.error(f"Error in style transfer: {str(e)}")
@@ -192,26 +648,8 @@ def apply_vangogh_style():
 @app.route("/remove-background", methods=["POST"])
 def remove_background():
     try:
-        if "photo" not in request.files:
-            return jsonify({"error": "No file uploaded"}), 400
-        
-        file = request.files["photo"]
-        if not file.filename:
-            return jsonify({"error": "Empty filename"}), 400
-
-        image = Image.open(file).convert('RGBA')
-        processed_image = background_editor.remove_background(image)
+        return _run_sync("remove-background")
 
-        current_time = int(time.time() * 1000)
-        output_filename = f"nobg_{current_time}_{file.filename}"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        processed_image.save(output_path, format='PNG')
-        
-        return jsonify({
-            "processed_image": output_filename,
-            "full_path": output_path
-        }), 200
-        
     except Exception as e:
         logger.error(f"Error in background removal: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -219,34 +657,8 @@ def remove_background():
 @app.route("/replace-background", methods=["POST"])
 def replace_background():
     try:
-        if "photo" not in request.files:
-            return jsonify({"error": "No file uploaded"}), 400
-        
-        background_path = request.form.get("background")
-        if not background_path:
-            return jsonify({"error": "No background path provided"}), 400
-     
-        background_name = os.path.basename(background_path)
-        logger.info(f"Background name: {background_name}")
-        
-        file = request.files["photo"]
-        if not file.filename:
-            return jsonify({"error": "Empty filename"}), 400
-        
-
-        image = Image.open(file).convert('RGBA')
-        processed_image = background_editor.replace_background(image, background_name)
-        
-        current_time = int(time.time() * 1000)
-        output_filename = f"newbg_{current_time}_{file.filename}"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        processed_image.save(output_path, format='PNG')
-        
-        return jsonify({
-            "processed_image": output_filename,
-            "full_path": output_path
-        }), 200
-        
+        return _run_sync("replace-background")
+
     except Exception as e:
         logger.error(f"Error in background replacement: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -254,30 +666,157 @@ def replace_background():
 @app.route("/enhance-face", methods=["POST"])
 def enhance_face():
     try:
-        if "photo" not in request.files:
-            return jsonify({"error": "No file uploaded"}), 400
-        
-        file = request.files["photo"]
-        if not file.filename:
-            return jsonify({"error": "Empty filename"}), 400
-        
-
-        image = Image.open(file).convert('RGB')
-        enhanced_image = face_enhancer.enhance_facial_features(image)
-        current_time = int(time.time() * 1000)
-        output_filename = f"enhanced_face_{current_time}_{file.filename}"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        enhanced_image.save(output_path)
-        
-        return jsonify({
-            "processed_image": output_filename,
-            "full_path": output_path,
-        }), 200
-        
+        return _run_sync("enhance-face")
+
     except Exception as e:
         logger.error(f"Error in facial enhancement: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/anonymize-faces", methods=["POST"])
+def anonymize_faces():
+    try:
+        return _run_sync("anonymize-faces")
+
+    except Exception as e:
+        logger.error(f"Error in face anonymisation: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/anonymize-faces/batch", methods=["POST"])
+def anonymize_faces_batch():
+    """Redact faces in many photos (or a zip of them), streaming an NDJSON manifest as each finishes"""
+    try:
+        inputs = collect_inputs(request.files.getlist("photos"),
+                                archive=request.files.get("archive"),
+                                max_files=BATCH_MAX_FILES)
+        if not inputs:
+            return jsonify({"error": "No files uploaded"}), 400
+
+        mode = request.args.get("mode", "blur").lower()
+        if mode not in ANONYMIZE_MODES:
+            return jsonify({"error": f"Unknown anonymisation mode: {mode}"}), 400
+        quality = int(request.args.get("quality", 95))
+    except Exception as e:
+        logger.error(f"Invalid batch request: {str(e)}")
+        return jsonify({"error": "Invalid batch request", "details": str(e)}), 400
+
+    anonymizer = models.get("face_anonymizer")
+    logger.info(f"Starting batch anonymisation of {len(inputs)} images")
+
+    def generate():
+        succeeded = 0
+        batch_time = int(time.time() * 1000)
+        for index, filename, result, error in anonymizer.run_batch(inputs, mode=mode, quality=quality):
+            entry = {"index": index, "filename": filename, "mode": mode}
+            if error is not None:
+                entry.update(status="error", error=error)
+            else:
+                data, fmt, faces, seconds = result
+                metrics.STAGE_SECONDS.observe(seconds, route="anonymize-faces-batch", stage="total")
+                output_filename = f"anonymized_{batch_time}_{index}_{filename}"
+                output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+                with open(output_path, "wb") as f:
+                    f.write(data)
+                entry.update(status="success", processed_image=output_filename,
+                             full_path=output_path, faces=faces, seconds=seconds)
+                succeeded += 1
+            yield json.dumps(entry) + "\n"
+
+        yield json.dumps({
+            "status": "complete",
+            "total": len(inputs),
+            "succeeded": succeeded,
+            "failed": len(inputs) - succeeded
+        }) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@app.route("/jobs/<kind>", methods=["POST"])
+def submit_job(kind):
+    if kind not in JOB_KINDS:
+        return jsonify({"error": f"Unknown job type: {kind}"}), 404
+
+    try:
+        task, error = JOB_KINDS[kind]()
+        if error:
+            return error
+
+        cached = _lookup_cache(task)
+        if cached is not None:
+            job = jobs.submit_result(kind, cached)
+        else:
+            job = jobs.submit(kind, task)
+    except QueueFull as e:
+        logger.warning(str(e))
+        return jsonify({"error": "Server busy, try again later"}), 503
+    except Exception as e:
+        logger.error(f"Error submitting {kind} job: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(job.to_dict()), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    # Long-poll: ?wait=N blocks up to N seconds for the job to finish
+    try:
+        wait = min(float(request.args.get("wait", 0)), MAX_JOB_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    if wait > 0:
+        job.wait(wait)
+
+    if job.status == DONE:
+        return _image_response(job.result)
+    return jsonify(job.to_dict()), 200
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route("/jobs/<job_id>/stop", methods=["POST"])
+def stop_job(job_id):
+    """Finish a running job early, keeping its current result (DELETE discards it)"""
+    job = jobs.stop(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Server-Sent Events: progress (and preview) events until the job finishes"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    # Reconnecting EventSource clients resume after the last event they saw;
+    # a malformed id replays from the start
+    try:
+        last_id = max(0, int(request.headers.get("Last-Event-ID") or 0))
+    except ValueError:
+        last_id = 0
+
+    def generate():
+        after = last_id
+        while True:
+            events = job.progress.wait(after, timeout=EVENTS_KEEPALIVE_SECONDS)
+            for event_id, event, data in events:
+                yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                after = event_id
+            if job.progress.closed and not job.progress.wait(after, timeout=0):
+                yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/outputs/<filename>')
 def get_enhanced_image(filename):
     print(filename)
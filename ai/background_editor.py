@@ -5,6 +5,7 @@ import numpy as np
 import cv2
 from ultralytics import YOLO
 import random
+from metrics import stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -52,7 +53,8 @@ class BackgroundEditor:
         
         if TESSERACT_AVAILABLE:
             try:
-                text_data = pytesseract.image_to_data(img_cv, output_type=pytesseract.Output.DICT)
+                with stage("tesseract", img_cv):
+                    text_data = pytesseract.image_to_data(img_cv, output_type=pytesseract.Output.DICT)
                 for i, text in enumerate(text_data['text']):
                     if text.strip():
                         x = text_data['left'][i]
@@ -65,7 +67,8 @@ class BackgroundEditor:
 
         if self.YOLO_AVAILABLE:
             try:
-                results = self.yolo_model(img_cv)
+                with stage("yolo", img_cv):
+                    results = self.yolo_model(img_cv)
                 for result in results:
                     boxes = result.boxes
                     for box in boxes:
@@ -142,7 +145,8 @@ class BackgroundEditor:
 
         try:
            
-            full_removed = remove(image)
+            with stage("rembg", image):
+                full_removed = remove(image)
             elements = self.detect_elements(image)
             
             if elements['people']:
@@ -151,7 +155,8 @@ class BackgroundEditor:
                     
                     result = Image.new('RGBA', image.size, (0, 0, 0, 0))
                     
-                    removed_bg = remove(image)
+                    with stage("rembg", image):
+                        removed_bg = remove(image)
                     
                     result.paste(removed_bg, mask=mask)
                     
@@ -179,10 +184,10 @@ class BackgroundEditor:
             if not os.path.exists(bg_path):
                 raise FileNotFoundError(f"Background {background_name} not found at {bg_path}")
             
-            background = Image.open(bg_path).convert('RGBA')
-            background = background.resize(image.size, Image.LANCZOS)
-            
-            return Image.alpha_composite(background, img_without_bg)
+            with stage("composite", image):
+                background = Image.open(bg_path).convert('RGBA')
+                background = background.resize(image.size, Image.LANCZOS)
+                return Image.alpha_composite(background, img_without_bg)
             
         except Exception as e:
             logger.error(f"Error replacing background: {str(e)}")
@@ -0,0 +1,112 @@
+import io
+import logging
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Per-process enhancer, created once by the pool initializer
+_worker_enhancer = None
+
+
+def _init_worker():
+    """Build one enhancer per worker and keep each worker single-threaded"""
+    global _worker_enhancer
+    import cv2
+    import torch
+    from ai_enhancement import AIImageEnhancer
+
+    # The pool already uses every core; nested OpenCV/torch threads would oversubscribe
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+    _worker_enhancer = AIImageEnhancer()
+
+
+def _enhance_one(data, filename, params):
+    """Decode, enhance and re-encode one image inside a worker process"""
+    from utils.image_io import output_format, encode_image, read_upload
+
+    start = time.perf_counter()
+    image = read_upload(_BytesUpload(data))
+    enhanced = _worker_enhancer.enhance(
+        image,
+        strength=params["strength"],
+        preserve_tone=params["preserve_tone"]
+    )
+    fmt = output_format(filename)
+    encoded = encode_image(enhanced, fmt, quality=params["quality"])
+    return encoded, fmt, round(time.perf_counter() - start, 3)
+
+
+class _BytesUpload:
+    """Minimal stand-in for a werkzeug FileStorage wrapping raw bytes"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+
+def collect_inputs(files, archive=None, max_files=200):
+    """Return [(filename, bytes)] from uploaded files and an optional zip archive"""
+    inputs = []
+    for file in files:
+        if file.filename:
+            inputs.append((os.path.basename(file.filename), file.read()))
+
+    if archive is not None and archive.filename:
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                inputs.append((name, zf.read(info)))
+
+    if len(inputs) > max_files:
+        raise ValueError(f"Too many files in batch: {len(inputs)} (max {max_files})")
+    return inputs
+
+
+class BatchEnhancer:
+    """Process pool that fans AIImageEnhancer.enhance out across cores"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+
+    def _get_executor(self):
+        # Created on first batch so single-image deployments never fork workers.
+        # "spawn" avoids forking a parent that already has torch/OpenCV threads.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    def run(self, inputs, params_for):
+        """Yield (index, filename, params, result, error) as each image finishes"""
+        executor = self._get_executor()
+        futures = {}
+        for index, (filename, data) in enumerate(inputs):
+            params = params_for(filename)
+            future = executor.submit(_enhance_one, data, filename, params)
+            futures[future] = (index, filename, params)
+
+        try:
+            for future in as_completed(futures):
+                index, filename, params = futures[future]
+                try:
+                    yield index, filename, params, future.result(), None
+                except Exception as e:
+                    logger.error(f"Batch enhancement failed for {filename}: {str(e)}")
+                    yield index, filename, params, None, str(e)
+        finally:
+            # Client went away or the generator was closed: drop queued work
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,304 @@
+"""
+Reproducible CPU benchmarks for the image engines.
+
+    python benchmarks/run_benchmarks.py                       # run all cases, compare with baseline
+    python benchmarks/run_benchmarks.py --engines enhance --sizes 2 12
+    python benchmarks/run_benchmarks.py --update-baseline     # store this run as the baseline
+
+Inputs are generated deterministically (seeded) at 0.3, 2, 12 and 24 MP, and
+with 0, 1 and 5 faces for the face engine. Synthetic faces are simple drawings
+that the landmark detector may not pick up; pass --face-image with a real
+portrait to paste that instead. Each case runs in a fresh process so the
+reported peak RSS belongs to that case alone. Model weights must already be
+in the local caches, the run never uses a GPU.
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Benchmarks run from the ai/ directory layout, like app.py
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AI_DIR not in sys.path:
+    sys.path.insert(0, AI_DIR)
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+logger = logging.getLogger("benchmarks")
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results.json")
+
+SIZES_MP = [0.3, 2, 12, 24]
+FACE_COUNTS = [0, 1, 5]
+FACE_SIZES_MP = [2, 12]
+ENGINES = ["enhance", "style_transfer", "face", "remove_background", "replace_background", "aesthetic"]
+
+# Engine name in this harness -> model registry name
+REGISTRY_NAMES = {
+    "enhance": "ai_enhancer",
+    "style_transfer": "style_transfer",
+    "face": "face_enhancer",
+    "remove_background": "background_editor",
+    "replace_background": "background_editor",
+    "aesthetic": "aesthetic_analyzer",
+}
+
+BACKGROUND_NAME = "bench_background.png"
+
+
+def synthetic_image(megapixels, faces=0, seed=0, face_image=None):
+    """Deterministic 4:3 RGB test image with gradients, texture, edges and optional faces"""
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    width = int(round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(seed)
+
+    gx = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    gy = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (255 * (0.6 * gx + 0.4 * gy)).astype(np.uint8)
+    image[..., 1] = (127 + 100 * np.sin(2 * np.pi * 3 * gx) * np.cos(2 * np.pi * 2 * gy)).astype(np.uint8)
+    image[..., 2] = (255 * (1 - 0.7 * gy) * (0.5 + 0.5 * gx)).astype(np.uint8)
+
+    # Hard edges and flat regions so edge-aware filters have realistic work
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        radius = int(rng.integers(max(4, width // 80), max(5, width // 12)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            cv2.circle(image, (x0, y0), radius, color, -1)
+        else:
+            cv2.rectangle(image, (x0, y0), (x0 + radius, y0 + radius // 2), color, -1)
+
+    noise = rng.integers(-10, 11, size=image.shape, dtype=np.int16)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    if faces:
+        face_size = int(min(height * 0.6, width / (faces + 1)))
+        portrait = None
+        if face_image is not None:
+            portrait = np.array(Image.open(face_image).convert("RGB").resize((face_size, face_size)))
+        for i in range(faces):
+            cx = int(width * (i + 1) / (faces + 1))
+            cy = height // 2
+            if portrait is not None:
+                x0, y0 = cx - face_size // 2, cy - face_size // 2
+                image[y0:y0 + face_size, x0:x0 + face_size] = portrait
+            else:
+                _draw_face(image, cx, cy, face_size)
+
+    return Image.fromarray(image)
+
+
+def _draw_face(image, cx, cy, size):
+    import cv2
+
+    axes = (int(size * 0.35), int(size * 0.45))
+    cv2.ellipse(image, (cx, cy), axes, 0, 0, 360, (224, 172, 140), -1)
+    eye_dy, eye_dx, eye_r = int(size * 0.1), int(size * 0.14), max(2, int(size * 0.04))
+    for dx in (-eye_dx, eye_dx):
+        cv2.circle(image, (cx + dx, cy - eye_dy), eye_r * 2, (255, 255, 255), -1)
+        cv2.circle(image, (cx + dx, cy - eye_dy), eye_r, (40, 30, 20), -1)
+    cv2.ellipse(image, (cx, cy + int(size * 0.2)), (int(size * 0.12), int(size * 0.05)),
+                0, 0, 180, (150, 60, 60), max(2, size // 60))
+
+
+def _call_engine(engine_name, engine, image):
+    if engine_name == "enhance":
+        return engine.enhance(image)
+    if engine_name == "style_transfer":
+        return engine.transfer_style(image)
+    if engine_name == "face":
+        return engine.enhance_facial_features(image)
+    if engine_name == "remove_background":
+        return engine.remove_background(image.convert("RGBA"))
+    if engine_name == "replace_background":
+        return engine.replace_background(image.convert("RGBA"), BACKGROUND_NAME)
+    if engine_name == "aesthetic":
+        composition = engine.analyze_composition(image)
+        exposure = engine.analyze_exposure(image)
+        engine.get_suggestions(composition, exposure)
+        return engine.predict_score(image)
+    raise ValueError(f"Unknown engine: {engine_name}")
+
+
+def _run_case(case, repeat, warmup, face_image):
+    """Run one case; executed in a fresh spawned process"""
+    import metrics
+    from model_registry import DEFAULT_ENGINES
+
+    logging.basicConfig(level=logging.WARNING)
+    image = synthetic_image(case["megapixels"], faces=case["faces"], face_image=face_image)
+
+    start = time.perf_counter()
+    engine = DEFAULT_ENGINES[REGISTRY_NAMES[case["engine"]]]()
+    load_seconds = time.perf_counter() - start
+
+    if case["engine"] == "replace_background":
+        backgrounds_dir = tempfile.mkdtemp(prefix="bench_bg_")
+        synthetic_image(case["megapixels"], seed=1).save(os.path.join(backgrounds_dir, BACKGROUND_NAME))
+        engine.backgrounds_dir = backgrounds_dir
+
+    with metrics.route(case["id"]):
+        for _ in range(warmup):
+            _call_engine(case["engine"], engine, image)
+
+        before = metrics.STAGE_SECONDS.snapshot()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _call_engine(case["engine"], engine, image)
+            timings.append(time.perf_counter() - start)
+        after = metrics.STAGE_SECONDS.snapshot()
+
+    stages = {}
+    for (route, stage), (total, count) in after.items():
+        if route != case["id"]:
+            continue
+        prev_total, prev_count = before.get((route, stage), (0.0, 0))
+        if count > prev_count:
+            stages[stage] = round((total - prev_total) / repeat, 4)
+
+    median = statistics.median(timings)
+    actual_mp = image.size[0] * image.size[1] / 1e6
+    return {
+        "engine": case["engine"],
+        "megapixels": round(actual_mp, 3),
+        "faces": case["faces"],
+        "load_seconds": round(load_seconds, 3),
+        "seconds": [round(t, 4) for t in timings],
+        "seconds_median": round(median, 4),
+        "throughput_mp_per_s": round(actual_mp / median, 4),
+        "peak_rss_bytes": metrics.peak_rss_bytes(),
+        "stages": stages,
+    }
+
+
+def build_cases(engines, sizes, face_counts):
+    cases = []
+    for engine in engines:
+        if engine == "face":
+            for mp in [size for size in sizes if size in FACE_SIZES_MP] or sizes[:1]:
+                for faces in face_counts:
+                    cases.append({"id": f"face_{mp}mp_{faces}faces", "engine": engine,
+                                  "megapixels": mp, "faces": faces})
+        else:
+            for mp in sizes:
+                cases.append({"id": f"{engine}_{mp}mp", "engine": engine, "megapixels": mp, "faces": 0})
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """Return human-readable regressions of throughput or peak RSS beyond threshold"""
+    regressions = []
+    for case_id, current in results.items():
+        reference = baseline.get("results", {}).get(case_id)
+        if not reference or "error" in current or "error" in reference:
+            continue
+
+        if current["throughput_mp_per_s"] < reference["throughput_mp_per_s"] * (1 - threshold):
+            regressions.append(
+                f"{case_id}: throughput {current['throughput_mp_per_s']} MP/s "
+                f"vs baseline {reference['throughput_mp_per_s']} MP/s")
+
+        if (current.get("peak_rss_bytes") and reference.get("peak_rss_bytes")
+                and current["peak_rss_bytes"] > reference["peak_rss_bytes"] * (1 + threshold)):
+            regressions.append(
+                f"{case_id}: peak RSS {current['peak_rss_bytes'] / 2**20:.0f} MiB "
+                f"vs baseline {reference['peak_rss_bytes'] / 2**20:.0f} MiB")
+    return regressions
+
+
+def environment():
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    try:
+        import cv2
+        info["opencv"] = cv2.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the foto-minds image engines on CPU")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument("--sizes", nargs="+", type=float, default=SIZES_MP, help="input sizes in megapixels")
+    parser.add_argument("--faces", nargs="+", type=int, default=FACE_COUNTS, help="face counts for the face engine")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--face-image", help="real portrait to paste instead of drawn faces")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sizes = [int(size) if float(size).is_integer() else size for size in args.sizes]
+    cases = build_cases(args.engines, sizes, args.faces)
+
+    results = {}
+    for case in cases:
+        logger.info(f"Running {case['id']}")
+        # A fresh process per case keeps peak RSS and warm caches independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            try:
+                results[case["id"]] = pool.submit(_run_case, case, args.repeat, args.warmup, args.face_image).result()
+                result = results[case["id"]]
+                logger.info(f"  {result['seconds_median']}s median, {result['throughput_mp_per_s']} MP/s, "
+                            f"peak RSS {(result['peak_rss_bytes'] or 0) / 2**20:.0f} MiB")
+            except Exception as e:
+                logger.error(f"  failed: {e}")
+                results[case["id"]] = {"engine": case["engine"], "error": str(e)}
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Updated baseline {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        logger.info("No baseline found; run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        logger.error(f"REGRESSION {regression}")
+    if not regressions:
+        logger.info(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
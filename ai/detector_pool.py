@@ -0,0 +1,46 @@
+import contextlib
+import queue
+import threading
+
+
+class DetectorPool:
+    """Bounded pool of non-thread-safe detectors, each used by one thread at a time
+
+    Instances are created on demand up to `size`; further checkouts wait
+    for one to be returned.
+    """
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def checkout(self):
+        detector = self._acquire()
+        try:
+            yield detector
+        finally:
+            self._idle.put(detector)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if not create:
+            return self._idle.get()
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
@@ -0,0 +1,127 @@
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from detector_pool import DetectorPool
+from metrics import stage
+from utils.image_io import output_format, encode_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ("grey", "blur", "pixelate")
+
+
+class FaceAnonymizer:
+    """Redacts faces found by the lightweight BlazeFace box detector
+
+    Only face boxes are needed, so this skips FaceMesh's 478 landmarks, and
+    every mode works on the face ROIs alone.
+    """
+
+    def __init__(self, detector_pool_size=None, detection_size=None, padding=0.2, pixel_blocks=12):
+        # Batches are bulk work, so by default there is a detector (and batch thread) per core
+        if detector_pool_size is None:
+            detector_pool_size = int(os.environ.get("ANONYMIZE_WORKERS", 0)) or os.cpu_count() or 1
+        if detection_size is None:
+            detection_size = int(os.environ.get("FACE_DETECTION_SIZE", 1280))
+        self.detection_size = detection_size
+        # Box padding, as a fraction of the face size on each side
+        self.padding = padding
+        # Blocks across the longer side of a face in pixelate mode
+        self.pixel_blocks = pixel_blocks
+        self.detectors = DetectorPool(self._create_detector, detector_pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.detectors.size, thread_name_prefix="anonymize")
+
+    def _create_detector(self):
+        import mediapipe as mp
+        # model_selection=1 is the full-range model, for faces further from the camera
+        return mp.solutions.face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
+
+    def detect_boxes(self, rgb):
+        """Padded (x_min, y_min, x_max, y_max) pixel boxes of the faces in an RGB array"""
+        height, width = rgb.shape[:2]
+        detect_image = rgb
+        if self.detection_size and max(height, width) > self.detection_size:
+            scale = self.detection_size / max(height, width)
+            detect_image = cv2.resize(rgb, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                      interpolation=cv2.INTER_AREA)
+
+        with stage("face_detection", detect_image), self.detectors.checkout() as detector:
+            results = detector.process(detect_image)
+
+        boxes = []
+        for detection in (results and results.detections) or []:
+            box = detection.location_data.relative_bounding_box
+            x, y, w, h = box.xmin * width, box.ymin * height, box.width * width, box.height * height
+            pad_x, pad_y = w * self.padding, h * self.padding
+            x_min, y_min = max(0, int(x - pad_x)), max(0, int(y - pad_y))
+            x_max, y_max = min(width, int(x + w + pad_x)), min(height, int(y + h + pad_y))
+            if x_min < x_max and y_min < y_max:
+                boxes.append((x_min, y_min, x_max, y_max))
+        return boxes
+
+    def redact(self, rgb, boxes, mode="blur"):
+        """Redact each box of an RGB (or BGR) uint8 array in place"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown anonymisation mode: {mode}")
+
+        for x_min, y_min, x_max, y_max in boxes:
+            roi = rgb[y_min:y_max, x_min:x_max]
+            height, width = roi.shape[:2]
+            if mode == "grey":
+                roi[...] = 128
+            elif mode == "blur":
+                # A kernel about a third of the face wipes out identifying detail
+                ksize = max(3, max(height, width) // 3) | 1
+                roi[...] = cv2.GaussianBlur(roi, (ksize, ksize), 0)
+            else:
+                scale = self.pixel_blocks / max(height, width)
+                small = cv2.resize(roi, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                   interpolation=cv2.INTER_AREA)
+                roi[...] = cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+        return rgb
+
+    def anonymize(self, image, mode="blur"):
+        """Return (copy of the PIL image with every detected face redacted, number of faces)"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        rgb = np.array(image)
+        boxes = self.detect_boxes(rgb)
+        with stage("redact", rgb):
+            self.redact(rgb, boxes, mode)
+        return Image.fromarray(rgb), len(boxes)
+
+    def _anonymize_one(self, data, filename, mode, quality):
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(data))
+        anonymized, faces = self.anonymize(image, mode)
+        fmt = output_format(filename)
+        encoded = encode_image(anonymized, fmt, quality=quality)
+        return encoded, fmt, faces, round(time.perf_counter() - start, 3)
+
+    def run_batch(self, inputs, mode="blur", quality=95):
+        """Yield (index, filename, (data, fmt, faces, seconds), error) as each image finishes
+
+        Images run on one thread per pooled detector; OpenCV and MediaPipe
+        release the GIL, so this uses several cores without worker processes.
+        """
+        futures = {self._executor.submit(self._anonymize_one, data, filename, mode, quality): (index, filename)
+                   for index, (filename, data) in enumerate(inputs)}
+        try:
+            for future in as_completed(futures):
+                index, filename = futures[future]
+                try:
+                    yield index, filename, future.result(), None
+                except Exception as e:
+                    logger.error(f"Anonymisation failed for {filename}: {str(e)}")
+                    yield index, filename, None, str(e)
+        finally:
+            for future in futures:
+                future.cancel()
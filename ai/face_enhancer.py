@@ -3,26 +3,76 @@ import numpy as np
 from PIL import Image
 import mediapipe as mp
 import logging
+import os
+import threading
 import torch
 import torch.nn as nn
 from models.expression_net import ExpressionCorrectionNet
 from utils.preprocessing import normalize_face, denormalize_face
+from utils.face_geometry import FaceLandmarks
+from utils.compositing import blend_into, scale_in_polygon
+from metrics import stage
+from model_optimizer import optimize_model
+from detector_pool import DetectorPool
+from face_anonymizer import FaceAnonymizer
 
 logger = logging.getLogger(__name__)
 
 class FaceEnhancer:
-    def __init__(self):
+    def __init__(self, face_batch_size=10, detector_pool_size=None, detection_size=None, refine_min_size=None,
+                 anonymizer=None):
+        # Faces per ExpressionCorrectionNet forward pass; FaceMesh finds at most 10
+        self.face_batch_size = face_batch_size
         self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
+        # FaceMesh is not thread-safe: each request checks one out of the pool,
+        # sized like the job pool by default so every worker can get one
+        if detector_pool_size is None:
+            detector_pool_size = int(os.environ.get("FACE_MESH_WORKERS", os.environ.get("JOB_WORKERS", 2)))
+        self.face_meshes = DetectorPool(self._create_face_mesh, detector_pool_size)
+        # Landmarks are found on a copy with this long side (0 = full resolution)
+        # and mapped back; crops, the network and blending stay at full resolution.
+        # Faces smaller than refine_min_size px in that copy are re-detected on a
+        # full-resolution crop around them (0 = off).
+        if detection_size is None:
+            detection_size = int(os.environ.get("FACE_DETECTION_SIZE", 1280))
+        if refine_min_size is None:
+            refine_min_size = int(os.environ.get("FACE_REFINE_MIN_SIZE", 0))
+        self.detection_size = detection_size
+        self.refine_min_size = refine_min_size
+        # Censoring uses a FaceAnonymizer: the shared one (or a callable returning it)
+        # when given, otherwise a private one built on first use
+        self._anonymizer = anonymizer
+        self._anonymizer_lock = threading.Lock()
+        self.expression_net = ExpressionCorrectionNet()
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.expression_net.to(self.device)
+        self._load_model_weights()
+        # Face crops vary in size; the example only fixes the channel layout
+        self.expression_net, report = optimize_model(
+            self.expression_net, "expression_net", torch.randn(1, 3, 128, 128, device=self.device)
+        )
+        self.optimizations = {"expression_net": report}
+
+    @property
+    def anonymizer(self):
+        with self._anonymizer_lock:
+            if self._anonymizer is None:
+                self._anonymizer = FaceAnonymizer(detector_pool_size=self.face_meshes.size,
+                                                  detection_size=self.detection_size)
+            elif callable(self._anonymizer):
+                self._anonymizer = self._anonymizer()
+            return self._anonymizer
+
+    def _create_face_mesh(self, static_image_mode=True):
+        # Pooled instances serve unrelated photos, so they must not track
+        # between calls; enhance_sequence creates its own tracking instance
+        return self.mp_face_mesh.FaceMesh(
+            static_image_mode=static_image_mode,
             max_num_faces=10,
             refine_landmarks=True,
             min_detection_confidence=0.5,
             min_tracking_confidence=0.5
         )
-        self.expression_net = ExpressionCorrectionNet()
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.expression_net.to(self.device)
-        self._load_model_weights()
 
     def _load_model_weights(self):
         """Load pre-trained weights for the expression correction network"""
@@ -55,29 +105,10 @@ class FaceEnhancer:
 
             if isinstance(image, np.ndarray):
                 image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-                
-            img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            results = self.face_mesh.process(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
-            if results and results.multi_face_landmarks:
-                for face_landmarks in results.multi_face_landmarks:
-                    height, width = img_cv.shape[:2]
-
-                    x_coordinates = [landmark.x * width for landmark in face_landmarks.landmark]
-                    y_coordinates = [landmark.y * height for landmark in face_landmarks.landmark]
-                    
-                    x_min, x_max = int(min(x_coordinates)), int(max(x_coordinates))
-                    y_min, y_max = int(min(y_coordinates)), int(max(y_coordinates))
-                    
-                    padding = 30
-                    x_min = max(0, x_min - padding)
-                    y_min = max(0, y_min - padding)
-                    x_max = min(width, x_max + padding)
-                    y_max = min(height, y_max + padding)
-                    
-                    img_cv[y_min:y_max, x_min:x_max] = 128
-            
-            return Image.fromarray(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
+
+            # Censoring only needs face boxes, not FaceMesh landmarks
+            censored, _ = self.anonymizer.anonymize(image, mode="grey")
+            return censored
             
         except Exception as e:
             logger.error(f"Face censoring failed: {e}")
@@ -90,28 +121,14 @@ class FaceEnhancer:
             if isinstance(image, np.ndarray):
                 image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
             
-            img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            if len(img_cv.shape) != 3 or img_cv.shape[2] != 3:
-                raise ValueError(f"Invalid input image format: {img_cv.shape}")
+            rgb = np.array(image)
+            if len(rgb.shape) != 3 or rgb.shape[2] != 3:
+                raise ValueError(f"Invalid input image format: {rgb.shape}")
+            img_cv = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
             
-            results = self.face_mesh.process(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
-            if results and results.multi_face_landmarks:
-                for face_landmarks in results.multi_face_landmarks:
-                    face_region = self._extract_face_region(img_cv, face_landmarks)
-                    if face_region is None:
-                        continue
-                    
-                    normalized_face = normalize_face(face_region)
-                    face_tensor = torch.from_numpy(normalized_face).float().to(self.device)
-                    
-                    with torch.no_grad():
-                        corrected_face = self.expression_net(face_tensor.unsqueeze(0))
-                    
-                    corrected_face = corrected_face.squeeze(0).cpu().numpy()
-                    corrected_face = denormalize_face(corrected_face)
-                    
-                    img_cv = self._blend_correction(img_cv, corrected_face, face_landmarks)
+            # Crop every face first so the network runs once per batch, not once per face
+            faces = self._crop_faces(img_cv, self._detect_faces(rgb))
+            self._apply_corrections([(img_cv, faces)])
             
             return Image.fromarray(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
             
@@ -119,46 +136,155 @@ class FaceEnhancer:
             logger.error(f"Error in face enhancement: {str(e)}")
             raise
 
-    def _extract_face_region(self, image, landmarks):
+    def enhance_sequence(self, frames, batch_frames=8):
+        """Enhance a burst or clip, yielding each enhanced frame in order
+
+        frames is any iterable of PIL images or BGR arrays (e.g. from
+        cv2.VideoCapture); each comes back in the same kind. One FaceMesh in
+        stream mode tracks the faces from frame to frame instead of detecting
+        them again, and ExpressionCorrectionNet runs on the faces of
+        batch_frames frames at once. Only that many frames are held at a
+        time, so memory does not grow with the clip length.
+        """
+        face_mesh = self._create_face_mesh(static_image_mode=False)
+        try:
+            pending = []
+            for frame in frames:
+                is_array = isinstance(frame, np.ndarray)
+                if is_array:
+                    img_cv = frame.copy()
+                    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                else:
+                    rgb = np.array(frame.convert('RGB'))
+                    img_cv = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+                # Landmarking must stay in frame order for tracking; the network waits for the batch
+                faces = self._crop_faces(img_cv, self._detect_faces(rgb, face_mesh=face_mesh))
+                pending.append((img_cv, faces, is_array))
+                if len(pending) >= batch_frames:
+                    yield from self._finish_frames(pending)
+                    pending = []
+            yield from self._finish_frames(pending)
+        finally:
+            face_mesh.close()
+
+    def _finish_frames(self, pending):
+        self._apply_corrections([(img_cv, faces) for img_cv, faces, _ in pending])
+        for img_cv, _, is_array in pending:
+            yield img_cv if is_array else Image.fromarray(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
+
+    def _crop_faces(self, img_cv, faces):
+        """[(256x256 crop, Face)] for every face that could be cropped"""
+        crops = []
+        for face in faces:
+            face_region = self._extract_face_region(img_cv, face)
+            if face_region is not None:
+                crops.append((face_region, face))
+        return crops
+
+    def _apply_corrections(self, frames):
+        """Correct the faces of all (img_cv, crops) frames in shared batches and blend them in place"""
+        corrected_faces = iter(self._correct_faces([face_region for _, crops in frames
+                                                    for face_region, _ in crops]))
+        for img_cv, crops in frames:
+            with stage("blend", img_cv):
+                for _, face in crops:
+                    self._blend_correction(img_cv, next(corrected_faces), face)
+
+    def _detect_faces(self, rgb, face_mesh=None):
+        """FaceLandmarks of an RGB frame, detected at detection_size and mapped to full resolution
+
+        Without face_mesh a still-image detector is checked out of the pool.
+        A given (tracking) face_mesh skips small-face refinement, whose crops
+        would break its tracking.
+        """
+        height, width = rgb.shape[:2]
+        scale = 1.0
+        if self.detection_size and max(height, width) > self.detection_size:
+            scale = self.detection_size / max(height, width)
+            detect_image = cv2.resize(rgb, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                      interpolation=cv2.INTER_AREA)
+        else:
+            detect_image = rgb
+
+        if face_mesh is not None:
+            with stage("face_mesh", detect_image):
+                results = face_mesh.process(detect_image)
+            return FaceLandmarks.from_mediapipe(results and results.multi_face_landmarks, rgb.shape)
+
+        with stage("face_mesh", detect_image), self.face_meshes.checkout() as face_mesh:
+            results = face_mesh.process(detect_image)
+            # FaceMesh landmarks are normalised, so they map to any resolution
+            faces = FaceLandmarks.from_mediapipe(results and results.multi_face_landmarks, rgb.shape)
+            if self.refine_min_size and len(faces):
+                faces = self._refine_small_faces(face_mesh, rgb, faces, scale)
+        return faces
+
+    def _refine_small_faces(self, face_mesh, rgb, faces, scale):
+        """Re-detect faces that were tiny at detection scale on a full-resolution crop around each"""
+        height, width = rgb.shape[:2]
+        points = []
+        for face in faces:
+            x_min, y_min, x_max, y_max = face.bbox(padding=0)
+            size = max(x_max - x_min, y_max - y_min)
+            if size * scale >= self.refine_min_size:
+                points.append(face.points)
+                continue
+
+            # A crop about three face widths across, so FaceMesh sees the face large
+            crop_x, crop_y = max(0, x_min - size), max(0, y_min - size)
+            crop = np.ascontiguousarray(rgb[crop_y:min(height, y_max + size), crop_x:min(width, x_max + size)])
+            with stage("face_refine", crop):
+                results = face_mesh.process(crop)
+            refined = FaceLandmarks.from_mediapipe(results and results.multi_face_landmarks, crop.shape)
+            if not len(refined):
+                points.append(face.points)
+                continue
+            # The crop may also catch a neighbour; keep the face nearest the original
+            offset = np.array([crop_x, crop_y, 0], dtype=np.float32)
+            centre = face.points[:, :2].mean(axis=0)
+            nearest = np.argmin(np.linalg.norm(refined.points[:, :, :2].mean(axis=1) + offset[:2] - centre, axis=1))
+            points.append(refined[nearest].points + offset)
+        return FaceLandmarks(np.stack(points), rgb.shape)
+
+    def _correct_faces(self, face_regions):
+        """Run ExpressionCorrectionNet over same-sized face crops in batches of face_batch_size"""
+        corrected_faces = []
+        for start in range(0, len(face_regions), self.face_batch_size):
+            chunk = face_regions[start:start + self.face_batch_size]
+            face_batch = torch.from_numpy(np.stack([normalize_face(face) for face in chunk])).to(self.device)
+
+            with torch.no_grad(), stage("expression_net", chunk[0]):
+                corrected = self.expression_net(face_batch)
+
+            corrected_faces.extend(denormalize_face(face) for face in corrected.cpu().numpy())
+        return corrected_faces
+
+    def _extract_face_region(self, image, face):
         """Extract face region using landmarks with proper channel handling"""
         try:
             if image is None or len(image.shape) != 3:
                 logger.error(f"Invalid image format: shape={image.shape if image is not None else None}")
                 return None
 
-            height, width = image.shape[:2]
-            
-            x_coordinates = [landmark.x * width for landmark in landmarks.landmark]
-            y_coordinates = [landmark.y * height for landmark in landmarks.landmark]
-            
-            x_min, x_max = int(min(x_coordinates)), int(max(x_coordinates))
-            y_min, y_max = int(min(y_coordinates)), int(max(y_coordinates))
-            
-            padding = 30
-            x_min = max(0, x_min - padding)
-            y_min = max(0, y_min - padding)
-            x_max = min(width, x_max + padding)
-            y_max = min(height, y_max + padding)
+            x_min, y_min, x_max, y_max = face.bbox()
 
             face_region = image[y_min:y_max, x_min:x_max]
             if face_region.shape[2] != 3:
                 logger.error(f"Invalid number of channels in face region: {face_region.shape}")
                 return None
-                
-            self.last_face_coords = (x_min, y_min, x_max, y_max)
+
             return cv2.resize(face_region, (256, 256))
             
         except Exception as e:
             logger.error(f"Face region extraction failed: {e}")
             return None
 
-    def _blend_correction(self, original, corrected, landmarks):
-        """Blend the corrected face back into the original image with proper channel handling"""
+    def _blend_correction(self, original, corrected, face, coords=None):
+        """Blend the corrected face into the original image, in place, with proper channel handling"""
         try:
-            if not hasattr(self, 'last_face_coords'):
-                return original
-                
-            x_min, y_min, x_max, y_max = self.last_face_coords
+            coords = coords or face.bbox()
+            x_min, y_min, x_max, y_max = coords
             
             if len(original.shape) != 3 or len(corrected.shape) != 3:
                 raise ValueError(f"Invalid image shapes: original={original.shape}, corrected={corrected.shape}")
@@ -166,75 +292,38 @@ class FaceEnhancer:
             if corrected.shape[2] != 3:
                 raise ValueError(f"Invalid number of channels in corrected image: {corrected.shape}")
 
-            face_height = y_max - y_min
-            face_width = x_max - x_min
-            corrected = cv2.resize(corrected, (face_width, face_height))
+            corrected = cv2.resize(corrected, (x_max - x_min, y_max - y_min))
 
-            mask = np.ones((face_height, face_width), dtype=np.float32)
-            mask = cv2.GaussianBlur(mask, (15, 15), 10)
-            mask = np.dstack([mask] * 3) 
-            
-            result = original.copy()
-            roi = result[y_min:y_max, x_min:x_max]
-            blended = (mask * corrected + (1 - mask) * roi).astype(np.uint8)
-            result[y_min:y_max, x_min:x_max] = blended
-            
-            return result
+            # Only the face's ROI is touched, in place; the feather mask is cached per size
+            return blend_into(original, corrected, coords)
             
         except Exception as e:
             logger.error(f"Blending failed: {e}")
             return original
 
-    def _enhance_eyes(self, image, landmarks):
+    def _enhance_eyes(self, image, face):
         """Enhance eye region"""
         try:
-
-            left_eye = [33, 246, 161, 160, 159, 158, 157, 173, 133, 155, 154, 153, 145, 144, 163, 7]
-            right_eye = [362, 398, 384, 385, 386, 387, 388, 466, 263, 249, 390, 373, 374, 380, 381, 382]
-            
-            height, width = image.shape[:2]
-            left_eye_region = np.array([(landmarks.landmark[i].x * width, landmarks.landmark[i].y * height) for i in left_eye], np.int32)
-            right_eye_region = np.array([(landmarks.landmark[i].x * width, landmarks.landmark[i].y * height) for i in right_eye], np.int32)
-            
-            for eye_region in [left_eye_region, right_eye_region]:
-                mask = np.zeros(image.shape[:2], dtype=np.uint8)
-                cv2.fillPoly(mask, [eye_region], 255)
-
-                eye_area = cv2.bitwise_and(image, image, mask=mask)
-                enhanced = cv2.addWeighted(eye_area, 1.2, np.zeros_like(eye_area), 0, 5)
-                image = cv2.add(cv2.bitwise_and(image, image, mask=cv2.bitwise_not(mask)), enhanced)
-            
+            for eye_region in [face.left_eye, face.right_eye]:
+                scale_in_polygon(image, eye_region, 1.2, 5)
             return image
         
         except Exception as e:
             logger.warning(f"Eye enhancement failed: {e}")
             return image
 
-    def _enhance_smile(self, image, landmarks, emotions):
+    def _enhance_smile(self, image, face, emotions):
         """Enhance smile region based on emotion"""
         try:
-
-            lips = [61, 146, 91, 181, 84, 17, 314, 405, 321, 375, 291, 308, 324, 318, 402, 317, 14, 87, 178, 88, 95]
-            
-            height, width = image.shape[:2]
-            lips_region = np.array([(landmarks.landmark[i].x * width, landmarks.landmark[i].y * height) for i in lips], np.int32)
-
-            mask = np.zeros(image.shape[:2], dtype=np.uint8)
-            cv2.fillPoly(mask, [lips_region], 255)
-            
             if emotions['happy'] > 50:
-                enhanced = cv2.addWeighted(image, 1.3, np.zeros_like(image), 0, 5)
-            else:
-                enhanced = cv2.addWeighted(image, 1.1, np.zeros_like(image), 0, 3)
-            
-            return cv2.add(cv2.bitwise_and(image, image, mask=cv2.bitwise_not(mask)), 
-                          cv2.bitwise_and(enhanced, enhanced, mask=mask))
+                return scale_in_polygon(image, face.lips, 1.3, 5)
+            return scale_in_polygon(image, face.lips, 1.1, 3)
         
         except Exception as e:
             logger.warning(f"Smile enhancement failed: {e}")
             return image
 
-    def _enhance_skin(self, image, landmarks):
+    def _enhance_skin(self, image, face):
         """Enhance skin texture"""
         try:
             blur = cv2.GaussianBlur(image, (5, 5), 0)
@@ -0,0 +1,257 @@
+import argparse
+import logging
+import os
+import threading
+import time
+
+import torch
+import torch.nn as nn
+import torchvision.transforms as transforms
+from PIL import Image
+from metrics import stage
+from style_library import DEFAULT_STYLE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets")
+WEIGHTS_DIR = os.path.join(ASSETS_DIR, "fast_styles")
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+class ConvLayer(nn.Module):
+    def __init__(self, in_channels, out_channels, kernel_size, stride):
+        super(ConvLayer, self).__init__()
+        self.pad = nn.ReflectionPad2d(kernel_size // 2)
+        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size, stride)
+
+    def forward(self, x):
+        return self.conv(self.pad(x))
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = ConvLayer(channels, channels, 3, 1)
+        self.norm1 = nn.InstanceNorm2d(channels, affine=True)
+        self.conv2 = ConvLayer(channels, channels, 3, 1)
+        self.norm2 = nn.InstanceNorm2d(channels, affine=True)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        out = self.relu(self.norm1(self.conv1(x)))
+        return x + self.norm2(self.conv2(out))
+
+
+class UpsampleConvLayer(nn.Module):
+    """Nearest upsample followed by a conv; avoids transposed-conv checkerboards"""
+
+    def __init__(self, in_channels, out_channels, kernel_size, upsample):
+        super(UpsampleConvLayer, self).__init__()
+        self.upsample = nn.Upsample(scale_factor=upsample, mode="nearest")
+        self.conv = ConvLayer(in_channels, out_channels, kernel_size, 1)
+
+    def forward(self, x):
+        return self.conv(self.upsample(x))
+
+
+class TransformerNet(nn.Module):
+    """Johnson et al. image transformation network: RGB in [0, 1] -> RGB in [0, 1]"""
+
+    def __init__(self):
+        super(TransformerNet, self).__init__()
+        self.encoder = nn.Sequential(
+            ConvLayer(3, 32, 9, 1), nn.InstanceNorm2d(32, affine=True), nn.ReLU(),
+            ConvLayer(32, 64, 3, 2), nn.InstanceNorm2d(64, affine=True), nn.ReLU(),
+            ConvLayer(64, 128, 3, 2), nn.InstanceNorm2d(128, affine=True), nn.ReLU(),
+        )
+        self.residuals = nn.Sequential(*[ResidualBlock(128) for _ in range(5)])
+        self.decoder = nn.Sequential(
+            UpsampleConvLayer(128, 64, 3, 2), nn.InstanceNorm2d(64, affine=True), nn.ReLU(),
+            UpsampleConvLayer(64, 32, 3, 2), nn.InstanceNorm2d(32, affine=True), nn.ReLU(),
+            ConvLayer(32, 3, 9, 1),
+        )
+
+    def forward(self, x):
+        return self.decoder(self.residuals(self.encoder(x)))
+
+
+def weights_path(style, weights_dir=WEIGHTS_DIR):
+    return os.path.join(weights_dir, f"{style}.pth")
+
+
+class FastStyleTransfer:
+    """Feed-forward style transfer: a single TransformerNet pass per image"""
+
+    def __init__(self, weights_dir=None, max_side=1024):
+        self.weights_dir = weights_dir or os.environ.get("FAST_STYLE_WEIGHTS_DIR", WEIGHTS_DIR)
+        # Activations at full resolution are 32 channels of float32, so very
+        # large inputs are stylised at max_side and resized back
+        self.max_side = max_side
+        self.device = torch.device("cpu")
+        self._nets = {}
+        self._lock = threading.Lock()
+        self.to_tensor = transforms.ToTensor()
+        self.to_image = transforms.ToPILImage()
+        logger.info(f"Fast style transfer using weights from {self.weights_dir}")
+
+    def available_styles(self):
+        if not os.path.isdir(self.weights_dir):
+            return []
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(self.weights_dir)
+                      if name.endswith(".pth"))
+
+    def has_style(self, style):
+        return os.path.exists(weights_path(style, self.weights_dir))
+
+    def _get_net(self, style):
+        net = self._nets.get(style)
+        if net is not None:
+            return net
+
+        with self._lock:
+            net = self._nets.get(style)
+            if net is None:
+                path = weights_path(style, self.weights_dir)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"No fast style weights for '{style}' at {path}; "
+                        f"train them with 'python fast_style_transfer.py --content-dir <images>'")
+                net = TransformerNet()
+                net.load_state_dict(torch.load(path, map_location=self.device, weights_only=True))
+                net.to(self.device).eval()
+                self._nets[style] = net
+                logger.info(f"Loaded fast style network '{style}'")
+        return net
+
+    def transfer_style(self, content_image, style=DEFAULT_STYLE, should_stop=None):
+        """Stylize an image in one forward pass; should_stop is accepted for API parity"""
+        try:
+            net = self._get_net(style)
+
+            if content_image.mode != 'RGB':
+                content_image = content_image.convert('RGB')
+            original_size = content_image.size
+
+            work_image = content_image
+            scale = self.max_side / max(original_size)
+            if scale < 1:
+                work_size = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+                work_image = content_image.resize(work_size, Image.BICUBIC)
+
+            with stage("fast_forward", work_image), torch.inference_mode():
+                output = net(self.to_tensor(work_image).unsqueeze(0).to(self.device))
+
+            with stage("postprocess", content_image):
+                image = self.to_image(output.squeeze(0).clamp(0, 1).cpu())
+                if image.size != original_size:
+                    image = image.resize(original_size, Image.BICUBIC)
+                return image
+
+        except Exception as e:
+            logger.error(f"Error during fast style transfer: {str(e)}")
+            raise
+
+
+class _ImageFolder(torch.utils.data.Dataset):
+    """Every image under a directory, without ImageFolder's class sub-folders"""
+
+    def __init__(self, root, transform):
+        self.paths = sorted(
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(root)
+            for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.transform(Image.open(self.paths[index]).convert('RGB'))
+
+
+def train(content_dir, style=DEFAULT_STYLE, output=None, epochs=2, image_size=256, batch_size=4,
+          lr=1e-3, style_weight=1e6, content_weight=1, tv_weight=1e-6, log_every=50):
+    """Fit a TransformerNet to one style's Gram targets and the VGG19 loss"""
+    from style_transfer import VanGoghStyleTransfer
+
+    output = output or weights_path(style)
+    torch.manual_seed(0)
+
+    # The optimisation engine owns the loss network and the style Gram targets,
+    # so both modes are trained and evaluated against the same objective
+    loss_engine = VanGoghStyleTransfer()
+    style_grams = loss_engine.styles.get(style)
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+    dataset = _ImageFolder(content_dir, transforms.Compose([
+        transforms.Resize(image_size),
+        transforms.CenterCrop(image_size),
+        transforms.ToTensor(),
+    ]))
+    if len(dataset) == 0:
+        raise ValueError(f"No training images found in {content_dir}")
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True, drop_last=True)
+    logger.info(f"Training fast style '{style}' on {len(dataset)} images for {epochs} epochs")
+
+    net = TransformerNet()
+    optimizer = torch.optim.Adam(net.parameters(), lr=lr)
+    start = time.perf_counter()
+    step = 0
+    for epoch in range(epochs):
+        for batch in loader:
+            optimizer.zero_grad()
+            stylized = net(batch)
+
+            output_features = loss_engine.get_features((stylized - mean) / std)
+            with torch.no_grad():
+                content_features = loss_engine.get_features((batch - mean) / std)
+
+            style_loss = sum(torch.mean((loss_engine.gram_matrix(output_features[str(idx)]) - style_grams[str(idx)]) ** 2)
+                             for idx in loss_engine.style_layers_idx)
+            content_loss = sum(torch.mean((output_features[str(idx)] - content_features[str(idx)]) ** 2)
+                               for idx in loss_engine.content_layers_idx)
+            tv_loss = (torch.mean(torch.abs(stylized[:, :, 1:, :] - stylized[:, :, :-1, :])) +
+                       torch.mean(torch.abs(stylized[:, :, :, 1:] - stylized[:, :, :, :-1])))
+
+            total_loss = style_weight * style_loss + content_weight * content_loss + tv_weight * tv_loss
+            total_loss.backward()
+            optimizer.step()
+
+            if step % log_every == 0:
+                logger.info(f"Epoch {epoch} step {step}: style: {style_loss.item():.4f}, "
+                            f"content: {content_loss.item():.4f}, "
+                            f"elapsed: {time.perf_counter() - start:.0f}s")
+            step += 1
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    torch.save(net.state_dict(), output)
+    logger.info(f"Saved fast style weights to {output}")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a feed-forward style network on CPU")
+    parser.add_argument("--content-dir", required=True, help="Directory of training photos (e.g. a COCO subset)")
+    parser.add_argument("--style", default=DEFAULT_STYLE, help="Style image name in the styles directory")
+    parser.add_argument("--output", help="Weights file (default: assets/fast_styles/<style>.pth)")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--style-weight", type=float, default=1e6)
+    parser.add_argument("--content-weight", type=float, default=1)
+    parser.add_argument("--tv-weight", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    train(args.content_dir, style=args.style, output=args.output, epochs=args.epochs,
+          image_size=args.image_size, batch_size=args.batch_size, lr=args.lr,
+          style_weight=args.style_weight, content_weight=args.content_weight, tv_weight=args.tv_weight)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from progress_stream import ProgressStream
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.cancel_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.progress = ProgressStream()
+        self._done = threading.Event()
+        self._future = None
+
+    def cancelled(self):
+        """Polled by long-running tasks to stop cooperatively"""
+        return self.cancel_event.is_set()
+
+    def stopping(self):
+        """True once the client asked to finish early and keep the current result"""
+        return self.stop_event.is_set()
+
+    def should_stop(self):
+        return self.cancelled() or self.stopping()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns True if it did"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "stopped_early": self.stopping(),
+        }
+
+
+class JobQueue:
+    """Bounded thread pool that runs jobs and keeps their state for polling"""
+
+    def __init__(self, max_workers=2, max_pending=32, ttl_seconds=600):
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, task):
+        """Queue task(job) and return the Job; raises QueueFull when saturated"""
+        self._prune()
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFull(f"Job queue is full ({pending} pending)")
+
+            job = Job(kind)
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(self._run, job, task)
+
+        logger.info(f"Queued job {job.id} ({kind})")
+        return job
+
+    def submit_result(self, kind, result):
+        """Record a job whose result is already known (e.g. a cache hit)"""
+        self._prune()
+        job = Job(kind)
+        job.started = job.created
+        job.result = result
+        with self._lock:
+            self._jobs[job.id] = job
+        self._finish(job, DONE)
+        return job
+
+    def counts(self):
+        """Number of known jobs per status"""
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask a running one to stop"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        job.cancel_event.set()
+        if job._future is not None and job._future.cancel():
+            self._finish(job, CANCELLED)
+        return job
+
+    def stop(self, job_id):
+        """Ask a job to finish early; unlike cancel() its partial result is kept"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        job.stop_event.set()
+        return job
+
+    def _run(self, job, task):
+        if job.cancelled():
+            self._finish(job, CANCELLED)
+            return
+
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            result = task(job)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            job.error = str(e)
+            job.exception = e
+            self._finish(job, FAILED)
+            return
+
+        if job.cancelled():
+            self._finish(job, CANCELLED)
+            return
+
+        job.result = result
+        self._finish(job, DONE)
+
+    def _finish(self, job, status):
+        # finished is set first: _prune on another thread reads it once status is final
+        job.finished = time.time()
+        job.status = status
+        job._done.set()
+        job.progress.close()
+        logger.info(f"Job {job.id} ({job.kind}) {status}")
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL so results don't pile up"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.status in FINISHED_STATES and job.finished is not None and job.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,225 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MEGAPIXEL_BUCKETS = (0.1, 0.3, 1, 2, 4, 8, 12, 16, 24, 48, 96)
+MEMORY_BUCKETS = tuple(2 ** i * 1024 * 1024 for i in range(0, 15))  # 1 MiB .. 16 GiB
+# How often the RSS sampler polls while any stage is running
+RSS_SAMPLE_SECONDS = 0.01
+
+_local = threading.local()
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with a fixed set of label names"""
+
+    def __init__(self, name, help_text, buckets, label_names=("route", "stage")):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self):
+        """{labels: (sum, count)} for computing deltas, e.g. in benchmarks"""
+        with self._lock:
+            return {key: (series["sum"], series["count"]) for key, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key))
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{_format(bound)}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {_format(series['sum'])}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "fotominds_stage_duration_seconds", "Wall time per processing stage", DURATION_BUCKETS)
+STAGE_MEGAPIXELS = Histogram(
+    "fotominds_stage_input_megapixels", "Input size per processing stage", MEGAPIXEL_BUCKETS)
+STAGE_RSS_GROWTH = Histogram(
+    "fotominds_stage_rss_growth_bytes",
+    "Peak RSS during each stage above the RSS at its start (process-wide, so concurrent stages overlap)",
+    MEMORY_BUCKETS)
+
+HISTOGRAMS = [STAGE_SECONDS, STAGE_MEGAPIXELS, STAGE_RSS_GROWTH]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def megapixels(image):
+    """Size of a PIL image or numpy array in megapixels"""
+    if image is None:
+        return None
+    if hasattr(image, "shape"):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+    return width * height / 1e6
+
+
+def peak_rss_bytes():
+    """High-water mark of the process resident set size over its whole lifetime"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+def current_rss_bytes():
+    """Resident set size right now"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class _RssSampler:
+    """Daemon thread tracking the peak RSS of every running stage
+
+    It only polls while at least one stage is open, so an idle server
+    does not wake up.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self._windows = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self, start_rss):
+        window = {"start": start_rss, "peak": start_rss}
+        with self._cond:
+            self._windows[id(window)] = window
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return window
+
+    def stop(self, window):
+        """Peak RSS of the window (including a final sample) above its start"""
+        rss = current_rss_bytes()
+        with self._cond:
+            self._windows.pop(id(window), None)
+            if rss is not None:
+                window["peak"] = max(window["peak"], rss)
+        return max(0, window["peak"] - window["start"])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._windows)
+            rss = current_rss_bytes()
+            if rss is not None:
+                with self._cond:
+                    for window in self._windows.values():
+                        window["peak"] = max(window["peak"], rss)
+            time.sleep(self.interval)
+
+
+_rss_sampler = _RssSampler()
+
+
+def current_route():
+    return getattr(_local, "route", "none")
+
+
+@contextmanager
+def route(name):
+    """Label every stage recorded on this thread with the given route"""
+    previous = getattr(_local, "route", None)
+    _local.route = name
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _local.route
+        else:
+            _local.route = previous
+
+
+@contextmanager
+def stage_prefix(prefix):
+    """Prefix the names of the stages recorded on this thread, e.g. for a nested proxy run"""
+    previous = getattr(_local, "stage_prefix", "")
+    _local.stage_prefix = previous + prefix
+    try:
+        yield
+    finally:
+        _local.stage_prefix = previous
+
+
+@contextmanager
+def stage(name, image=None):
+    """Record wall time, input megapixels and RSS growth for one processing stage"""
+    name = getattr(_local, "stage_prefix", "") + name
+    start_rss = current_rss_bytes()
+    window = _rss_sampler.start(start_rss) if start_rss is not None else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        labels = {"route": current_route(), "stage": name}
+        STAGE_SECONDS.observe(time.perf_counter() - start, **labels)
+        size = megapixels(image)
+        if size is not None:
+            STAGE_MEGAPIXELS.observe(size, **labels)
+        if window is not None:
+            STAGE_RSS_GROWTH.observe(_rss_sampler.stop(window), **labels)
+
+
+def render(extra=None):
+    """Prometheus text exposition of all histograms plus {name: (type, help, value)} samples"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, (metric_type, help_text, value) in (extra or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name} {_format(value)}")
+    return "\n".join(lines) + "\n"
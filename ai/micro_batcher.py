@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    def __init__(self, item, key):
+        self.item = item
+        self.key = key
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Groups calls that arrive within a short window into one batched call
+
+    `process_batch(items)` receives a list of items sharing the same key and
+    returns one result per item, in order. A single worker thread runs the
+    batches, so while one batch is busy the next one fills up.
+    """
+
+    def __init__(self, process_batch, max_batch_size=4, window_seconds=0.05, name="micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.name = name
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, item, key=None):
+        """Queue an item and block until its batch has run; returns its result"""
+        request = _Request(item, key)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._cond.notify_all()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _take_batch(self):
+        """Wait for a first request, then up to window_seconds for more with its key"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            key = self._pending[0].key
+            deadline = time.monotonic() + self.window_seconds
+            while True:
+                batch = [request for request in self._pending if request.key == key][:self.max_batch_size]
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            for request in batch:
+                self._pending.remove(request)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                results = list(self.process_batch([request.item for request in batch]))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"process_batch returned {len(results)} results for {len(batch)} items")
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {str(e)}")
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
@@ -0,0 +1,220 @@
+import contextlib
+import copy
+import json
+import logging
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-model options, all off unless enabled in MODEL_OPTIMIZATIONS:
+#   inference_mode  run under torch.inference_mode (inference-only models)
+#   channels_last   NHWC weights and inputs, usually faster for oneDNN convs
+#   compile         "trace" / "script" (TorchScript) or "compile" (torch.compile)
+#   bf16            bfloat16 autocast, only applied when the CPU supports it
+#   quantize        "dynamic" (int8 Linear) or "static" (int8 FX, calibrated)
+#   max_drift       largest accepted output drift vs fp32, relative to its range
+#   backend         "onnx" serves the model's ONNX export with onnxruntime instead
+#                   (see onnx_backend.py); falls back to the torch options above
+OPTIONS = ("inference_mode", "channels_last", "compile", "bf16", "quantize", "max_drift", "backend")
+DEFAULT_MAX_DRIFT = 0.02
+
+# Options that would break models we differentiate through (style transfer)
+INFERENCE_ONLY_OPTIONS = ("inference_mode", "quantize", "backend")
+
+
+def load_config():
+    """MODEL_OPTIMIZATIONS: inline JSON or a path to a JSON file, {model name or "*": {option: value}}"""
+    value = os.environ.get("MODEL_OPTIMIZATIONS", "").strip()
+    if not value:
+        return {}
+    try:
+        if not value.startswith("{"):
+            with open(value) as f:
+                value = f.read()
+        return json.loads(value)
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring invalid MODEL_OPTIMIZATIONS: {str(e)}")
+        return {}
+
+
+def options_for(name, config=None):
+    config = load_config() if config is None else config
+    options = dict(config.get("*", {}), **config.get(name, {}))
+    unknown = set(options) - set(OPTIONS)
+    if unknown:
+        logger.warning(f"Unknown optimisation options for {name}: {sorted(unknown)}")
+    return {key: value for key, value in options.items() if key in OPTIONS}
+
+
+def bf16_supported():
+    """True when oneDNN has native bfloat16 kernels on this CPU"""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class OptimizedModel(nn.Module):
+    """Wraps a (possibly converted) model with the per-call optimisations"""
+
+    def __init__(self, model, inference_mode=False, channels_last=False, bf16=False):
+        super(OptimizedModel, self).__init__()
+        self.model = model
+        self.inference_mode = inference_mode
+        self.channels_last = channels_last
+        self.bf16 = bf16
+
+    def forward(self, x):
+        with contextlib.ExitStack() as stack:
+            if self.inference_mode:
+                stack.enter_context(torch.inference_mode())
+            if self.bf16:
+                stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+            if self.channels_last and x.dim() == 4:
+                x = x.contiguous(memory_format=torch.channels_last)
+            output = self.model(x)
+        return _to_float(output) if self.bf16 else output
+
+
+def _to_float(output):
+    if isinstance(output, torch.Tensor):
+        return output.float()
+    return type(output)(_to_float(value) for value in output)
+
+
+def _flatten(output):
+    if isinstance(output, torch.Tensor):
+        return [output]
+    return [tensor for value in output for tensor in _flatten(value)]
+
+
+def check_drift(reference, candidate, inputs):
+    """Output difference of candidate vs reference over the inputs, relative to the reference range"""
+    max_abs = 0.0
+    mean_abs = 0.0
+    scale = 0.0
+    count = 0
+    with torch.no_grad():
+        for x in inputs:
+            for expected, actual in zip(_flatten(reference(x)), _flatten(candidate(x))):
+                diff = (expected.float() - actual.float()).abs()
+                max_abs = max(max_abs, diff.max().item())
+                mean_abs += diff.mean().item()
+                scale = max(scale, expected.float().abs().max().item())
+                count += 1
+    return {
+        "max_abs": max_abs,
+        "mean_abs": mean_abs / max(count, 1),
+        "relative": max_abs / scale if scale > 0 else max_abs,
+    }
+
+
+def _convert(model, options, example_input, calibration_inputs):
+    """Apply the structural options (quantisation, memory format, graph capture)"""
+    model = copy.deepcopy(model).eval()
+
+    quantize = options.get("quantize")
+    if quantize == "dynamic":
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    elif quantize == "static":
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), (example_input,))
+        with torch.no_grad():
+            for x in calibration_inputs:
+                prepared(x)
+        model = convert_fx(prepared)
+    elif quantize:
+        raise ValueError(f"Unknown quantize mode: {quantize}")
+
+    if options.get("channels_last"):
+        model = model.to(memory_format=torch.channels_last)
+        example_input = example_input.contiguous(memory_format=torch.channels_last)
+
+    compile_mode = options.get("compile")
+    if compile_mode == "trace":
+        with torch.no_grad():
+            model = torch.jit.trace(model, example_input, check_trace=False)
+        if options.get("inference_mode"):
+            model = torch.jit.freeze(model)
+    elif compile_mode == "script":
+        model = torch.jit.script(model)
+        if options.get("inference_mode"):
+            model = torch.jit.freeze(model)
+    elif compile_mode == "compile":
+        model = torch.compile(model, dynamic=True)
+    elif compile_mode:
+        raise ValueError(f"Unknown compile mode: {compile_mode}")
+
+    return model
+
+
+def optimize_model(model, name, example_input, calibration_inputs=None, options=None, requires_grad=False):
+    """Return (model, report) with the configured optimisations for `name` applied
+
+    With backend "onnx" the model's ONNX export is served instead when it
+    exists and matches; otherwise the torch options apply. The optimised
+    model is checked against the fp32 eager model on the example and
+    calibration inputs; when its drift exceeds max_drift, or conversion
+    fails, the original model is returned unchanged. requires_grad models
+    (differentiated w.r.t. their input) never get inference-only options.
+    """
+    options = options_for(name) if options is None else dict(options)
+    if requires_grad:
+        for key in INFERENCE_ONLY_OPTIONS:
+            if options.pop(key, None):
+                logger.warning(f"Ignoring '{key}' for {name}: its outputs need gradients")
+    max_drift = options.pop("max_drift", DEFAULT_MAX_DRIFT)
+    backend = options.pop("backend", None) or "torch"
+    if options.get("bf16") and not bf16_supported():
+        logger.info(f"bf16 autocast requested for {name} but this CPU lacks native support")
+        options["bf16"] = False
+
+    enabled = {key: value for key, value in options.items() if value}
+    report = {"options": enabled, "accepted": False, "drift": None, "error": None}
+    if not enabled and backend == "torch":
+        return model, report
+
+    model.eval()
+    inputs = [example_input] + list(calibration_inputs or [])
+    if backend == "onnx":
+        from onnx_backend import load_onnx_model
+        onnx_model, onnx_report = load_onnx_model(model, name, inputs, max_drift)
+        if onnx_model is not None:
+            return onnx_model, onnx_report
+        report["onnx"] = onnx_report
+    elif backend != "torch":
+        logger.error(f"Unknown backend for {name}: {backend}, using torch")
+    if not enabled:
+        return model, report
+
+    try:
+        start = time.perf_counter()
+        converted = _convert(model, enabled, example_input, inputs)
+        optimized = OptimizedModel(
+            converted,
+            inference_mode=bool(enabled.get("inference_mode")),
+            channels_last=bool(enabled.get("channels_last")),
+            bf16=bool(enabled.get("bf16"))
+        ).eval()
+        # The first calls also run torch.compile / TorchScript optimisation passes
+        report["drift"] = check_drift(model, optimized, inputs)
+        report["seconds"] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        logger.error(f"Optimising {name} with {enabled} failed, using fp32 eager: {str(e)}")
+        report["error"] = str(e)
+        return model, report
+
+    if report["drift"]["relative"] > max_drift:
+        logger.warning(f"Optimised {name} drifts {report['drift']['relative']:.4f} "
+                       f"(> {max_drift}) from fp32, using fp32 eager")
+        return model, report
+
+    report["accepted"] = True
+    logger.info(f"Optimised {name} with {enabled} (drift {report['drift']['relative']:.5f})")
+    return optimized, report
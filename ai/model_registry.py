@@ -0,0 +1,169 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _build_aesthetic_analyzer():
+    from aesthetic_model import AestheticAnalyzer
+    return AestheticAnalyzer()
+
+
+def _build_background_editor():
+    from background_editor import BackgroundEditor
+    return BackgroundEditor()
+
+
+def _build_face_enhancer(registry=None):
+    from face_enhancer import FaceEnhancer
+    # With a registry, censoring borrows its face_anonymizer instead of a second detector pool
+    anonymizer = (lambda: registry.get("face_anonymizer")) if registry is not None else None
+    return FaceEnhancer(anonymizer=anonymizer)
+
+
+def _build_face_anonymizer():
+    from face_anonymizer import FaceAnonymizer
+    return FaceAnonymizer()
+
+
+def _build_style_transfer():
+    from style_transfer import VanGoghStyleTransfer
+    return VanGoghStyleTransfer()
+
+
+def _build_fast_style_transfer():
+    from fast_style_transfer import FastStyleTransfer
+    return FastStyleTransfer()
+
+
+def _build_ai_enhancer():
+    from ai_enhancement import AIImageEnhancer
+    return AIImageEnhancer()
+
+
+# Engine name -> factory. Imports happen inside the factories so that heavy
+# libraries (torch, mediapipe, ultralytics) are only pulled in when needed.
+DEFAULT_ENGINES = {
+    "aesthetic_analyzer": _build_aesthetic_analyzer,
+    "background_editor": _build_background_editor,
+    "face_enhancer": _build_face_enhancer,
+    "face_anonymizer": _build_face_anonymizer,
+    "style_transfer": _build_style_transfer,
+    "fast_style_transfer": _build_fast_style_transfer,
+    "ai_enhancer": _build_ai_enhancer,
+}
+
+
+class ModelRegistry:
+    """Builds engines on first use and keeps a single instance of each"""
+
+    def __init__(self, factories=None):
+        self._factories = dict(factories if factories is not None else DEFAULT_ENGINES)
+        if factories is None:
+            self._factories["face_enhancer"] = functools.partial(_build_face_enhancer, self)
+        self._instances = {}
+        self._errors = {}
+        self._load_seconds = {}
+        self._loading = set()
+        self._name_locks = {name: threading.Lock() for name in self._factories}
+        self._warmup_names = []
+        self._warmup_thread = None
+
+    def register(self, name, factory):
+        """Register (or replace) the factory for an engine"""
+        self._factories[name] = factory
+        self._name_locks.setdefault(name, threading.Lock())
+
+    @property
+    def names(self):
+        return list(self._factories)
+
+    def get(self, name):
+        """Return the engine, building it on the first call"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        if name not in self._factories:
+            raise KeyError(f"Unknown engine: {name}")
+
+        # Per-engine lock: concurrent first requests build the engine once,
+        # while other engines can still be built in parallel.
+        with self._name_locks[name]:
+            instance = self._instances.get(name)
+            if instance is not None:
+                return instance
+
+            self._loading.add(name)
+            start = time.perf_counter()
+            try:
+                logger.info(f"Loading engine '{name}'")
+                instance = self._factories[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.error(f"Failed to load engine '{name}': {str(e)}")
+                raise
+            finally:
+                self._loading.discard(name)
+
+            self._load_seconds[name] = round(time.perf_counter() - start, 3)
+            self._errors.pop(name, None)
+            self._instances[name] = instance
+            logger.info(f"Engine '{name}' loaded in {self._load_seconds[name]}s")
+            return instance
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def warm_up(self, names, background=True):
+        """Build the given engines now, optionally in a daemon thread"""
+        names = [name for name in names if name in self._factories]
+        self._warmup_names = names
+
+        def _run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    # Already logged in get(); the route will retry on demand.
+                    continue
+
+        if not background:
+            _run()
+            return None
+
+        self._warmup_thread = threading.Thread(target=_run, name="model-warmup", daemon=True)
+        self._warmup_thread.start()
+        return self._warmup_thread
+
+    def status(self):
+        """Per-engine load state, used by the readiness endpoint"""
+        engines = {}
+        for name in self._factories:
+            engines[name] = {
+                "loaded": name in self._instances,
+                "loading": name in self._loading,
+                "load_seconds": self._load_seconds.get(name),
+                "error": self._errors.get(name),
+                "warmup": name in self._warmup_names,
+                "optimizations": getattr(self._instances.get(name), "optimizations", None),
+            }
+        return engines
+
+    def is_ready(self):
+        """Ready once every engine scheduled for warm-up has loaded"""
+        return all(name in self._instances for name in self._warmup_names)
+
+
+def warmup_names_from_env(default="ai_enhancer,style_transfer"):
+    """Parse WARMUP_MODELS: comma separated names, 'all' or 'none'"""
+    value = os.environ.get("WARMUP_MODELS", default).strip().lower()
+    if value in ("", "none"):
+        return []
+    if value == "all":
+        return list(DEFAULT_ENGINES)
+    return [name.strip() for name in value.split(",") if name.strip()]
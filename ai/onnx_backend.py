@@ -0,0 +1,158 @@
+import argparse
+import logging
+import os
+import time
+
+import torch
+
+from model_optimizer import check_drift
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ONNX_DIR = os.path.join(os.path.dirname(__file__), "assets", "onnx")
+OPSET_VERSION = 17
+
+# Exportable models: name -> (example input shape, dynamic axes beyond batch, shared by input and output)
+EXPORTS = {
+    "expression_net": ((1, 3, 256, 256), {2: "height", 3: "width"}),
+    "aesthetic_model": ((1, 3, 224, 224), {}),
+}
+
+
+def onnx_dir():
+    return os.environ.get("ONNX_DIR", ONNX_DIR)
+
+
+def onnx_path(name, directory=None):
+    return os.path.join(directory or onnx_dir(), f"{name}.onnx")
+
+
+def session_options():
+    """CPU session options; each job worker gets an equal share of the cores by default
+
+    ONNX_INTRA_OP_THREADS / ONNX_INTER_OP_THREADS override the thread counts.
+    """
+    import onnxruntime as ort
+
+    workers = max(1, int(os.environ.get("JOB_WORKERS", 2)))
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = int(os.environ.get("ONNX_INTRA_OP_THREADS", max(1, (os.cpu_count() or 1) // workers)))
+    options.inter_op_num_threads = int(os.environ.get("ONNX_INTER_OP_THREADS", 1))
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+class OnnxModel:
+    """Runs an exported model in an onnxruntime CPU session, tensor in and tensor out"""
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=session_options(),
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        outputs = self.session.run(None, {self.input_name: x.detach().cpu().float().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+
+def export_model(model, name, directory=None):
+    """Export `model` to <directory>/<name>.onnx with a dynamic batch axis"""
+    shape, dynamic = EXPORTS[name]
+    path = onnx_path(name, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    axes = {0: "batch", **dynamic}
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model, torch.randn(*shape), path,
+            input_names=["input"], output_names=["output"],
+            dynamic_axes={"input": axes, "output": axes},
+            opset_version=OPSET_VERSION
+        )
+    logger.info(f"Exported {name} to {path}")
+    return path
+
+
+def load_onnx_model(model, name, inputs, max_drift):
+    """Return (OnnxModel or None, report) for `name`, checked against the torch model
+
+    None means the caller should keep serving with torch: the export is
+    missing, onnxruntime is unavailable or fails, or its outputs drift more
+    than max_drift from the torch model (e.g. a stale export).
+    """
+    path = onnx_path(name)
+    report = {"options": {"backend": "onnx"}, "accepted": False, "drift": None, "error": None, "path": path}
+    if not os.path.exists(path):
+        logger.info(f"No ONNX export for {name} at {path}, using torch")
+        report["error"] = "export missing"
+        return None, report
+
+    try:
+        start = time.perf_counter()
+        onnx_model = OnnxModel(path)
+        model.eval()
+        # Also run a batch of two to check the batch axis really is dynamic
+        report["drift"] = check_drift(model, onnx_model, list(inputs) + [torch.cat([inputs[0]] * 2)])
+        report["seconds"] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        logger.error(f"Loading ONNX model for {name} failed, using torch: {str(e)}")
+        report["error"] = str(e)
+        return None, report
+
+    if report["drift"]["relative"] > max_drift:
+        logger.warning(f"ONNX {name} drifts {report['drift']['relative']:.4f} "
+                       f"(> {max_drift}) from torch, using torch; re-export it")
+        return None, report
+
+    report["accepted"] = True
+    logger.info(f"Serving {name} with onnxruntime (drift {report['drift']['relative']:.5f})")
+    return onnx_model, report
+
+
+def _build(name, weights=None):
+    if name == "expression_net":
+        from models.expression_net import ExpressionCorrectionNet
+        model = ExpressionCorrectionNet()
+    else:
+        from aesthetic_model import AestheticModel
+        model = AestheticModel()
+
+    if weights:
+        model.load_state_dict(torch.load(weights, map_location="cpu"))
+    elif name == "expression_net":
+        raise ValueError("--weights is required for expression_net")
+    else:
+        # Its conv1 and fc are freshly initialised on every start, so an export
+        # without saved weights won't match a running server and will be rejected
+        logger.warning("Exporting aesthetic_model without --weights")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export models for the onnxruntime backend")
+    parser.add_argument("--model", required=True, choices=sorted(EXPORTS))
+    parser.add_argument("--weights", help="State dict to export (the one the server loads)")
+    parser.add_argument("--output-dir", help="Directory for <model>.onnx (default: ONNX_DIR or assets/onnx)")
+    args = parser.parse_args()
+
+    model = _build(args.model, args.weights)
+    export_model(model, args.model, args.output_dir)
+
+    # Same parity check the server runs before serving the export
+    shape, _ = EXPORTS[args.model]
+    inputs = [torch.randn(*shape), torch.randn(4, *shape[1:])]
+    drift = check_drift(model, OnnxModel(onnx_path(args.model, args.output_dir)), inputs)
+    logger.info(f"ONNX parity for {args.model}: {drift}")
+
+
+if __name__ == "__main__":
+    main()
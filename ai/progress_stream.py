@@ -0,0 +1,79 @@
+import base64
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.image_io import encode_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Previews of every job are encoded on this one thread, never on the optimiser's
+_preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+
+
+class ProgressStream:
+    """Numbered progress events of one job, for Server-Sent Events readers
+
+    Producers call publish() (cheap, never blocks on readers); readers call
+    wait() with the last event id they have seen. Only the most recent
+    `history` events are kept, so a slow reader skips ahead instead of
+    holding memory.
+    """
+
+    def __init__(self, history=256):
+        self._events = collections.deque(maxlen=history)
+        self._next_id = 1
+        self._closed = False
+        self._cond = threading.Condition()
+        self._preview_pending = False
+
+    def publish(self, event, data):
+        with self._cond:
+            self._events.append((self._next_id, event, data))
+            self._next_id += 1
+            self._cond.notify_all()
+
+    def close(self):
+        """No more events will follow; wakes up waiting readers"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def wait(self, after=0, timeout=None):
+        """Events with an id greater than `after`, waiting up to timeout for one"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or (self._events and self._events[-1][0] > after), timeout)
+            return [entry for entry in self._events if entry[0] > after]
+
+    def preview(self, tensor, to_image, quality=70, **info):
+        """Encode a JPEG preview of `tensor` off the caller's thread
+
+        to_image(tensor) must return a PIL image. The tensor should be
+        a detached copy. If the previous preview of this stream is still
+        being encoded the new one is dropped, so previews never queue up.
+        """
+        with self._cond:
+            if self._preview_pending or self._closed:
+                return False
+            self._preview_pending = True
+
+        def _encode():
+            try:
+                image = to_image(tensor)
+                data = base64.b64encode(encode_image(image, "JPEG", quality=quality)).decode("ascii")
+                self.publish("preview", dict(info, width=image.size[0], height=image.size[1],
+                                             image=f"data:image/jpeg;base64,{data}"))
+            except Exception as e:
+                logger.error(f"Failed to encode preview: {str(e)}")
+            finally:
+                with self._cond:
+                    self._preview_pending = False
+
+        _preview_executor.submit(_encode)
+        return True
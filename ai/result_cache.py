@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Two-tier (memory LRU + on-disk) cache of encoded results keyed by input hash"""
+
+    def __init__(self, directory, memory_bytes=256 * 1024 * 1024, disk_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan_disk()
+
+    @staticmethod
+    def make_key(endpoint, image, params=None):
+        """Hash the decoded pixels together with the endpoint and its parameters"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(endpoint.encode())
+        digest.update(json.dumps(params or {}, sort_keys=True).encode())
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return (data, meta) for a cached result, or None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry
+
+            if key in self._disk:
+                entry = self._read_disk(key)
+                if entry is not None:
+                    self._disk.move_to_end(key)
+                    self.counters["disk_hits"] += 1
+                    self._put_memory(key, entry)
+                    return entry
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, data, meta):
+        with self._lock:
+            entry = (data, meta)
+            self._put_memory(key, entry)
+            self._put_disk(key, entry)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.counters,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_size,
+                memory_budget=self.memory_bytes,
+                disk_entries=len(self._disk),
+                disk_bytes=self._disk_size,
+                disk_budget=self.disk_bytes,
+            )
+
+    def _put_memory(self, key, entry):
+        size = len(entry[0])
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key)[0])
+
+        self._memory[key] = entry
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.counters["memory_evictions"] += 1
+
+    def _paths(self, key):
+        return os.path.join(self.directory, f"{key}.bin"), os.path.join(self.directory, f"{key}.json")
+
+    def _put_disk(self, key, entry):
+        data, meta = entry
+        size = len(data)
+        if size > self.disk_bytes or key in self._disk:
+            return
+
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(data_path, "wb") as f:
+                f.write(data)
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+            return
+
+        self._disk[key] = size
+        self._disk_size += size
+        while self._disk_size > self.disk_bytes:
+            evicted, evicted_size = self._disk.popitem(last=False)
+            self._disk_size -= evicted_size
+            self._remove_disk(evicted)
+            self.counters["disk_evictions"] += 1
+
+    def _read_disk(self, key):
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(data_path, "rb") as f:
+                data = f.read()
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(data_path)
+            return data, meta
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self._disk_size -= self._disk.pop(key, 0)
+            self._remove_disk(key)
+            return None
+
+    def _remove_disk(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _scan_disk(self):
+        """Rebuild the disk index from a previous run, oldest access first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            key = name[:-4]
+            data_path, meta_path = self._paths(key)
+            if not os.path.exists(meta_path):
+                self._remove_disk(key)
+                continue
+            stat = os.stat(data_path)
+            entries.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+        while self._disk_size > self.disk_bytes:
+            evicted, evicted_size = self._disk.popitem(last=False)
+            self._disk_size -= evicted_size
+            self._remove_disk(evicted)
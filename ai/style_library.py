@@ -0,0 +1,124 @@
+import functools
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STYLES_DIR = os.path.join(os.path.dirname(__file__), "assets")
+DEFAULT_STYLE = "vangogh_starry_night"
+STYLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def default_styles_dir():
+    return os.environ.get("STYLES_DIR", STYLES_DIR)
+
+
+def discover_styles(styles_dir=None):
+    """{name: path} for every style image in the directory (name = file stem)"""
+    styles_dir = styles_dir or default_styles_dir()
+    if not os.path.isdir(styles_dir):
+        return {}
+    return {
+        os.path.splitext(name)[0]: os.path.join(styles_dir, name)
+        for name in sorted(os.listdir(styles_dir))
+        if name.lower().endswith(STYLE_EXTENSIONS)
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def _file_hash(path, size, mtime_ns):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def style_hash(path):
+    """Content hash of a style image; only re-read when its size or mtime changes"""
+    stat = os.stat(path)
+    return _file_hash(path, stat.st_size, stat.st_mtime_ns)
+
+
+class StyleLibrary:
+    """Per-style Gram matrices, computed once, persisted to disk and kept in a small LRU
+
+    `compute(path)` builds the {layer: gram} dict for one style image; `version`
+    identifies the feature extractor and transform so a change invalidates the
+    persisted files.
+    """
+
+    def __init__(self, compute, version, styles_dir=None, cache_dir=None, max_resident=4):
+        self.compute = compute
+        self.version = version
+        self.styles_dir = styles_dir or default_styles_dir()
+        self.cache_dir = cache_dir or os.path.join(self.styles_dir, ".grams")
+        self.max_resident = max_resident
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self._style_locks = {}
+
+    def names(self):
+        return list(discover_styles(self.styles_dir))
+
+    def get(self, name):
+        """Gram matrices for a style, loading or computing them on first use
+
+        Resident entries are keyed by the image's content hash, so replacing
+        a style image under the same name takes effect on the next call.
+        """
+        path = discover_styles(self.styles_dir).get(name)
+        if path is None:
+            raise KeyError(f"Unknown style: {name}")
+        digest = style_hash(path)
+
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is not None and entry[0] == digest:
+                self._resident.move_to_end(name)
+                return entry[1]
+            style_lock = self._style_locks.setdefault(name, threading.Lock())
+
+        # One loader per style; other styles (and resident hits) don't wait
+        with style_lock:
+            with self._lock:
+                entry = self._resident.get(name)
+            if entry is not None and entry[0] == digest:
+                grams = entry[1]
+            else:
+                grams = self._load(name, path, digest)
+            with self._lock:
+                self._resident[name] = (digest, grams)
+                self._resident.move_to_end(name)
+                while len(self._resident) > self.max_resident:
+                    evicted, _ = self._resident.popitem(last=False)
+                    logger.info(f"Evicted style '{evicted}' from memory")
+            return grams
+
+    def _load(self, name, path, digest):
+        import torch
+
+        cache_path = os.path.join(self.cache_dir, f"{name}-{digest}-{self.version}.pt")
+        if os.path.exists(cache_path):
+            try:
+                grams = torch.load(cache_path, weights_only=True)
+                logger.info(f"Loaded Gram matrices for style '{name}' from {cache_path}")
+                return grams
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable Gram cache {cache_path}: {str(e)}")
+
+        logger.info(f"Computing Gram matrices for style '{name}'")
+        grams = self.compute(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write then rename so a concurrent reader never sees a partial file
+            tmp_path = f"{cache_path}.tmp{os.getpid()}"
+            torch.save(grams, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not persist Gram matrices for '{name}': {str(e)}")
+        return grams
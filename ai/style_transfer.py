@@ -1,17 +1,50 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torchvision.transforms as transforms
 import torchvision.models as models
 from PIL import Image
 import logging
-import os
+import math
+import time
+from metrics import stage
+from model_optimizer import optimize_model
+from style_library import StyleLibrary, DEFAULT_STYLE
+
+# Bump when the feature extractor or style transform changes so persisted
+# Gram matrices are recomputed
+GRAM_VERSION = 2
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class VGGFeatures(nn.Module):
+    """Runs the VGG layers and returns the outputs of the given layer indices, in order"""
+
+    def __init__(self, layers, indices):
+        super(VGGFeatures, self).__init__()
+        self.layers = layers
+        self.indices = list(indices)
+
+    def forward(self, x):
+        features = []
+        for i, layer in enumerate(self.layers):
+            x = layer(x)
+            if i in self.indices:
+                features.append(x)
+        return tuple(features)
+
+
 class VanGoghStyleTransfer:
-    def __init__(self):
+    def __init__(self, max_steps=100, tolerance=1e-3, patience=5, time_budget=None,
+                 styles_dir=None, max_resident_styles=4):
         try:
+            # Defaults for transfer_style; each call may override them
+            self.max_steps = max_steps
+            self.tolerance = tolerance
+            self.patience = patience
+            self.time_budget = time_budget
+
             self.device = torch.device("cpu") 
             logger.info(f"Using device: {self.device}")
 
@@ -21,17 +54,35 @@ class VanGoghStyleTransfer:
                 transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
             ])
 
-            self.model = models.vgg19(pretrained=True).features.to(self.device).eval()
-
-
             self.style_layers_idx = [0, 5, 10, 19, 28]
-            self.content_layers_idx = [21]            
+            self.content_layers_idx = [21]
 
-            style_path = os.path.join(os.path.dirname(__file__), "assets", "vangogh_starry_night.jpg")
-            if not os.path.exists(style_path):
-                raise FileNotFoundError(f"Style image not found at {style_path}")
+            # Only run VGG19 up to the deepest layer we read (28 of 37). VGG's
+            # ReLUs are in-place, so captured conv outputs end up activated;
+            # keep the ReLU after the deepest one so its features match too.
+            # The weights are frozen: gradients are only needed w.r.t. the image.
+            last_idx = max(self.style_layers_idx + self.content_layers_idx)
+            self.model = models.vgg19(pretrained=True).features[:last_idx + 2].to(self.device).eval()
+            for param in self.model.parameters():
+                param.requires_grad_(False)
 
-            self.style_features = self.get_style_features(style_path)
+            # Gradients flow through the extractor back to the image, so only
+            # options that keep autograd intact are applied here
+            self.feature_layers = sorted(set(self.style_layers_idx + self.content_layers_idx))
+            self.extractor, report = optimize_model(
+                VGGFeatures(self.model, self.feature_layers), "vgg19_features",
+                torch.randn(1, 3, 300, 300, device=self.device), requires_grad=True
+            )
+            self.optimizations = {"vgg19_features": report}
+
+            # Style Gram matrices are computed on first use of each style and
+            # persisted, so neither startup nor idle styles cost anything
+            version = (f"v{GRAM_VERSION}-vgg19-{'_'.join(map(str, self.style_layers_idx))}"
+                       f"-{'_'.join(map(str, self.content_layers_idx))}-300")
+            self.styles = StyleLibrary(self.get_style_features, version, styles_dir=styles_dir,
+                                       max_resident=max_resident_styles)
+            if DEFAULT_STYLE not in self.styles.names():
+                raise FileNotFoundError(f"Style image '{DEFAULT_STYLE}' not found in {self.styles.styles_dir}")
             logger.info("Style transfer model initialized successfully")
 
         except Exception as e:
@@ -39,90 +90,365 @@ class VanGoghStyleTransfer:
             raise
 
     def get_features(self, x):
-        features = {}
-        for i, layer in enumerate(self.model):
-            x = layer(x)
-            if i in self.style_layers_idx:
-                features[str(i)] = x
-            if i in self.content_layers_idx:
-                features[str(i)] = x
-        return features
+        outputs = self.extractor(x)
+        return {str(i): output for i, output in zip(self.feature_layers, outputs)}
 
     def get_style_features(self, style_path):
         try:
             style_img = Image.open(style_path).convert('RGB')
             style_tensor = self.transform(style_img).unsqueeze(0).to(self.device)
 
-            features = self.get_features(style_tensor)
+            with torch.no_grad():
+                features = self.get_features(style_tensor)
             return {k: self.gram_matrix(v) for k, v in features.items()}
 
         except Exception as e:
             logger.error(f"Error loading style image: {str(e)}")
             raise
 
-    def transfer_style(self, content_image):
+    @property
+    def style_features(self):
+        """Gram matrices of the default style"""
+        return self.styles.get(DEFAULT_STYLE)
+
+    def available_styles(self):
+        return self.styles.names()
+
+    def transfer_style(self, content_image, should_stop=None, max_steps=None, tolerance=None,
+                       time_budget=None, return_stats=False, style=DEFAULT_STYLE, on_progress=None):
+        """Stylize an image; should_stop() is polled every step to abort early
+
+        Optimisation ends after max_steps, once the relative loss improvement
+        stays below tolerance for `patience` steps, or when time_budget seconds
+        have passed. on_progress(info, output) is called after every step with
+        the losses and ETA and the current (3, h, w) tensor, still attached to
+        the optimiser, so it must return quickly. With return_stats, returns
+        (image, stats).
+        """
+        image, stats = self.transfer_style_batch(
+            [content_image], styles=style, should_stop=should_stop, max_steps=max_steps,
+            tolerance=tolerance, time_budget=time_budget, on_progress=on_progress)[0]
+        return (image, stats) if return_stats else image
+
+    def transfer_style_batch(self, content_images, styles=DEFAULT_STYLE, should_stop=None,
+                             max_steps=None, tolerance=None, time_budget=None, on_progress=None):
+        """Stylize several images in one optimisation; returns [(image, stats)]
+
+        Every option may be a single value or a list with one value per image.
+        Each image stops on its own (convergence, step or time budget,
+        should_stop) and is then dropped from the batch, so the remaining
+        images keep optimising without paying for finished ones.
+        """
         try:
-            logger.info("Starting style transfer process")
+            count = len(content_images)
+            logger.info(f"Starting style transfer process for {count} image(s)")
+            styles = _per_image(styles, count)
+
+            content_images = [image if image.mode == 'RGB' else image.convert('RGB') for image in content_images]
+            original_sizes = [image.size for image in content_images]
+            first_image = content_images[0]
 
+            with stage("content_features", first_image):
+                content_tensor = torch.stack([self.transform(image) for image in content_images]).to(self.device)
+
+            with stage("optimise", first_image):
+                results, stats = self._optimise(
+                    content_tensor, content_tensor, [self.styles.get(style) for style in styles],
+                    should_stop, max_steps, tolerance, time_budget, on_progress)
+
+            with stage("postprocess", first_image):
+                return [(self.postprocess_image(result, size), image_stats)
+                        for result, size, image_stats in zip(results, original_sizes, stats)]
+            
+        except Exception as e:
+            logger.error(f"Error during style transfer: {str(e)}")
+            raise
+
+    def transfer_style_multiscale(self, content_image, target_size=None, style=DEFAULT_STYLE,
+                                  should_stop=None, max_steps=None, tolerance=None, time_budget=None,
+                                  refine_steps=20, base_size=300, tile_size=512, tile_overlap=64,
+                                  return_stats=False, on_progress=None):
+        """Coarse-to-fine stylisation with `target_size` px on the long side
+
+        The image is optimised at a coarse scale (long side between base_size
+        and twice that), then upsampled and refined for refine_steps at each
+        doubling up to the target. Refinement scales larger than tile_size^2
+        pixels run in overlapping tiles so memory stays bounded; the coarse
+        scale always runs whole. on_progress is passed to every untiled
+        scale, with the scale index in its info.
+        """
+        try:
             if content_image.mode != 'RGB':
                 content_image = content_image.convert('RGB')
-            original_size = content_image.size
-            
-            content_tensor = self.transform(content_image).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                content_features = self.get_features(content_tensor)
+            width, height = content_image.size
+            target_size = target_size or max(width, height)
+            scale = target_size / max(width, height)
+            output_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            logger.info(f"Starting multi-scale style transfer to {output_size[0]}x{output_size[1]}")
 
-            output = content_tensor.clone().requires_grad_(True)
-            
-            optimizer = torch.optim.Adam([output], lr=0.01)
-            num_steps = 100  
-            
-            style_weight = 1e6
-            content_weight = 1
-
-            for step in range(num_steps):
-                def closure():
-                    optimizer.zero_grad()
-                    
-                    output_features = self.get_features(output)
-                    
-                    style_loss = 0
-                    for idx in self.style_layers_idx:
-                        key = str(idx)
-                        gram_output = self.gram_matrix(output_features[key])
-                        gram_style = self.style_features[key]
-                        style_loss += torch.mean((gram_output - gram_style)**2)
-
-                    content_loss = sum(torch.mean((output_features[str(idx)] - 
-                                                 content_features[str(idx)])**2)
-                                     for idx in self.content_layers_idx)
-
-                    total_loss = style_weight * style_loss + content_weight * content_loss
-
-                    if step < num_steps - 1:
-                        total_loss.backward(retain_graph=True)
+            # Long sides halve from the target down to the coarse scale
+            sides = [target_size]
+            while sides[-1] / 2 >= base_size:
+                sides.append(sides[-1] / 2)
+            sizes = [(max(1, round(output_size[0] * side / target_size)),
+                      max(1, round(output_size[1] * side / target_size))) for side in reversed(sides)]
+
+            style_grams = self.styles.get(style)
+            stats = {"scales": [], "steps": 0, "stopped": "max_steps"}
+            output = None
+            start = time.perf_counter()
+
+            for index, (scale_width, scale_height) in enumerate(sizes):
+                remaining = None
+                if time_budget is not None:
+                    remaining = time_budget - (time.perf_counter() - start)
+                    # The coarse scale always runs, so there is an output to return
+                    if remaining <= 0 and output is not None:
+                        stats["stopped"] = "time_budget"
+                        break
+
+                content_tensor = self._to_tensor(content_image, (scale_width, scale_height))
+                if output is None:
+                    init_tensor, steps, stage_name = content_tensor, max_steps, "optimise"
+                else:
+                    init_tensor = F.interpolate(output, size=(scale_height, scale_width),
+                                                mode="bilinear", align_corners=False)
+                    steps, stage_name = refine_steps, "refine"
+
+                with stage(stage_name, content_tensor[0, 0]):
+                    # The coarse scale is never tiled: it is what gives the refinements global structure
+                    if index > 0 and scale_width * scale_height > tile_size * tile_size:
+                        output, scale_stats = self._optimise_tiled(
+                            content_tensor, init_tensor, style_grams, tile_size, tile_overlap,
+                            should_stop, steps, tolerance, remaining)
                     else:
-                        total_loss.backward()
-                    
-                    if step % 10 == 0:
-                        logger.info(f"Step {step}: style: {style_loss.item():.4f}, "
-                                  f"content: {content_loss.item():.4f}")
-                    
-                    return total_loss
+                        results, scale_stats = self._optimise(
+                            content_tensor, init_tensor, [style_grams], should_stop, steps, tolerance, remaining,
+                            _with_info(on_progress, scale=index, scales=len(sizes)))
+                        output, scale_stats = results[0].unsqueeze(0), scale_stats[0]
 
-                optimizer.step(closure)
+                stats["scales"].append(dict(scale_stats, size=[scale_width, scale_height]))
+                stats["steps"] += scale_stats["steps"]
+                stats["stopped"] = scale_stats["stopped"]
+                if scale_stats["stopped"] in ("cancelled", "time_budget"):
+                    break
 
+            # An interrupted run is upsampled from the last scale it finished
+            with stage("postprocess", content_image):
+                image = self.postprocess_image(output.squeeze(0), output_size)
+
+            seconds = time.perf_counter() - start
+            megapixels = output_size[0] * output_size[1] / 1e6
+            stats.update({
+                "final_loss": next((scale["final_loss"] for scale in reversed(stats["scales"])
+                                    if scale["final_loss"] is not None), None),
+                "seconds": round(seconds, 3),
+                "megapixels": round(megapixels, 3),
+                "seconds_per_megapixel": round(seconds / megapixels, 3),
+            })
+            logger.info(f"Multi-scale style transfer took {stats['seconds_per_megapixel']}s/MP")
+            return (image, stats) if return_stats else image
 
-            return self.postprocess_image(output.detach().cpu().squeeze(), original_size)
-            
         except Exception as e:
-            logger.error(f"Error during style transfer: {str(e)}")
+            logger.error(f"Error during multi-scale style transfer: {str(e)}")
             raise
 
+    def _optimise_tiled(self, content_tensor, init_tensor, style_grams, tile_size, overlap,
+                        should_stop=None, max_steps=None, tolerance=None, time_budget=None):
+        """Refine a large image tile by tile and feather the tiles back together"""
+        _, _, height, width = content_tensor.shape
+        output = torch.zeros_like(init_tensor)
+        weights = torch.zeros((1, 1, height, width))
+        stats = {"steps": 0, "final_loss": None, "stopped": "max_steps", "tiles": 0}
+        start = time.perf_counter()
+
+        for top, bottom in _tile_spans(height, tile_size, overlap):
+            for left, right in _tile_spans(width, tile_size, overlap):
+                remaining = None if time_budget is None else max(0, time_budget - (time.perf_counter() - start))
+                results, tile_stats = self._optimise(
+                    content_tensor[:, :, top:bottom, left:right], init_tensor[:, :, top:bottom, left:right],
+                    [style_grams], should_stop, max_steps, tolerance, remaining)
+                weight = (_tile_ramp(top, bottom, height, overlap)[:, None] *
+                          _tile_ramp(left, right, width, overlap)[None, :])
+                output[:, :, top:bottom, left:right] += results[0] * weight
+                weights[:, :, top:bottom, left:right] += weight
+
+                stats["tiles"] += 1
+                stats["steps"] = max(stats["steps"], tile_stats[0]["steps"])
+                if tile_stats[0]["final_loss"] is not None:
+                    stats["final_loss"] = tile_stats[0]["final_loss"]
+                if tile_stats[0]["stopped"] in ("cancelled", "time_budget"):
+                    stats["stopped"] = tile_stats[0]["stopped"]
+
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        return output / weights, stats
+
+    def _to_tensor(self, image, size):
+        """Normalised (1, 3, h, w) tensor at an arbitrary size, unlike the square transform"""
+        tensor = transforms.functional.to_tensor(image.resize(size, Image.BICUBIC))
+        tensor = transforms.functional.normalize(tensor, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        return tensor.unsqueeze(0).to(self.device)
+
+    def _optimise(self, content_tensor, init_tensor, style_grams, should_stop=None,
+                  max_steps=None, tolerance=None, time_budget=None, on_progress=None):
+        """Optimise init_tensor (b, 3, h, w) towards the content and per-image styles
+
+        Returns ([result tensor per image], [stats per image]).
+        """
+        count = content_tensor.shape[0]
+        should_stop = _per_image(should_stop, count)
+        on_progress = _per_image(on_progress, count)
+        max_steps = [self.max_steps if v is None else v for v in _per_image(max_steps, count)]
+        tolerance = [self.tolerance if v is None else v for v in _per_image(tolerance, count)]
+        time_budget = [self.time_budget if v is None else v for v in _per_image(time_budget, count)]
+
+        # Per-image style targets, stacked so each sample is compared to its own
+        style_targets = {str(idx): torch.cat([grams[str(idx)] for grams in style_grams])
+                         for idx in self.style_layers_idx}
+        with torch.no_grad():
+            content_features = self.get_features(content_tensor)
+
+        output = init_tensor.clone().requires_grad_(True)
+        
+        optimizer = torch.optim.Adam([output], lr=0.01)
+        
+        style_weight = 1e6
+        content_weight = 1
+
+        stats = [{"steps": 0, "final_loss": None, "stopped": "max_steps", "batch_size": count}
+                 for _ in range(count)]
+        results = [None] * count
+        # Batch row -> image index for the images still being optimised
+        active = list(range(count))
+        previous_loss = [None] * count
+        flat_steps = [0] * count
+        start = time.perf_counter()
+
+        for step in range(max(max_steps)):
+            elapsed = time.perf_counter() - start
+            finished = []
+            for i in active:
+                if should_stop[i] is not None and should_stop[i]():
+                    logger.info(f"Style transfer stopped at step {step}")
+                    stats[i]["stopped"] = "cancelled"
+                elif time_budget[i] is not None and elapsed >= time_budget[i]:
+                    logger.info(f"Style transfer hit its {time_budget[i]}s budget at step {step}")
+                    stats[i]["stopped"] = "time_budget"
+                elif step >= max_steps[i]:
+                    stats[i]["stopped"] = "max_steps"
+                else:
+                    continue
+                finished.append(i)
+            if finished:
+                output, active = self._retire(optimizer, output, active, finished, results, stats, start)
+                if not active:
+                    break
+            rows = torch.tensor(active)
+
+            optimizer.zero_grad()
+
+            output_features = self.get_features(output)
+
+            style_loss = 0
+            for idx in self.style_layers_idx:
+                key = str(idx)
+                gram_output = self.gram_matrix(output_features[key])
+                gram_style = style_targets[key][rows]
+                style_loss += torch.mean((gram_output - gram_style)**2, dim=(1, 2))
+
+            content_loss = sum(torch.mean((output_features[str(idx)] -
+                                         content_features[str(idx)][rows])**2, dim=(1, 2, 3))
+                             for idx in self.content_layers_idx)
+
+            # Samples don't interact, so the gradient of the sum is
+            # each sample's own gradient
+            total_loss = style_weight * style_loss + content_weight * content_loss
+            total_loss.sum().backward()
+            optimizer.step()
+
+            losses = total_loss.tolist()
+
+            if step % 10 == 0:
+                logger.info(f"Step {step}: style: {style_loss.mean().item():.4f}, "
+                          f"content: {content_loss.mean().item():.4f}, active: {len(active)}")
+
+            if any(on_progress[i] is not None for i in active):
+                self._report_progress(on_progress, output, active, step, start, max_steps, time_budget,
+                                      losses, (style_weight * style_loss).tolist(),
+                                      (content_weight * content_loss).tolist())
+
+            # An image has converged once its loss stops improving by
+            # more than `tolerance` (relative) for `patience` steps
+            converged = []
+            for i, loss in zip(active, losses):
+                stats[i]["steps"] = step + 1
+                stats[i]["final_loss"] = loss
+                if previous_loss[i] is not None and previous_loss[i] > 0:
+                    improvement = (previous_loss[i] - loss) / previous_loss[i]
+                    flat_steps[i] = flat_steps[i] + 1 if improvement < tolerance[i] else 0
+                    if flat_steps[i] >= self.patience:
+                        logger.info(f"Style transfer converged at step {step}")
+                        stats[i]["stopped"] = "converged"
+                        converged.append(i)
+                previous_loss[i] = loss
+            if converged:
+                output, active = self._retire(optimizer, output, active, converged, results, stats, start)
+                if not active:
+                    break
+
+        if active:
+            self._retire(optimizer, output, active, list(active), results, stats, start)
+        return results, stats
+
+    def _report_progress(self, on_progress, output, active, step, start, max_steps, time_budget,
+                         losses, style_losses, content_losses):
+        """Call each image's on_progress with its losses and an ETA from the mean step time"""
+        elapsed = time.perf_counter() - start
+        seconds_per_step = elapsed / (step + 1)
+        for row, i in enumerate(active):
+            if on_progress[i] is None:
+                continue
+            eta = seconds_per_step * (max_steps[i] - step - 1)
+            if time_budget[i] is not None:
+                eta = min(eta, max(0.0, time_budget[i] - elapsed))
+            on_progress[i]({
+                "step": step + 1,
+                "max_steps": max_steps[i],
+                "loss": losses[row],
+                "style_loss": style_losses[row],
+                "content_loss": content_losses[row],
+                "elapsed": round(elapsed, 3),
+                "eta_seconds": round(eta, 3),
+            }, output[row])
+
+    def _retire(self, optimizer, output, active, finished, results, stats, start):
+        """Store finished images and shrink the batch (and Adam's state) to the rest"""
+        seconds = round(time.perf_counter() - start, 3)
+        keep_rows = [row for row, i in enumerate(active) if i not in finished]
+        for row, i in enumerate(active):
+            if i in finished:
+                results[i] = output[row].detach().cpu().clone()
+                stats[i]["seconds"] = seconds
+
+        remaining = [active[row] for row in keep_rows]
+        if not remaining:
+            return output, remaining
+
+        keep = torch.tensor(keep_rows)
+        state = optimizer.state.pop(output, {})
+        output = output.detach()[keep].clone().requires_grad_(True)
+        optimizer.param_groups[0]["params"] = [output]
+        if state:
+            optimizer.state[output] = {
+                name: value[keep].clone() if name in ("exp_avg", "exp_avg_sq") else value
+                for name, value in state.items()
+            }
+        return output, remaining
+
     def gram_matrix(self, x):
         b, c, h, w = x.size()
-        features = x.view(c, h * w)
-        gram = torch.mm(features, features.t())
+        features = x.view(b, c, h * w)
+        gram = torch.bmm(features, features.transpose(1, 2))
         return gram.div(c * h * w)
 
     def postprocess_image(self, tensor, original_size):
@@ -138,3 +464,41 @@ class VanGoghStyleTransfer:
             image = image.resize(original_size, Image.BICUBIC)
 
         return image
+
+
+def _per_image(value, count):
+    """Broadcast a scalar option to one value per image"""
+    if isinstance(value, (list, tuple)):
+        if len(value) != count:
+            raise ValueError(f"Expected {count} values, got {len(value)}")
+        return list(value)
+    return [value] * count
+
+
+def _with_info(on_progress, **extra):
+    """Wrap an on_progress callback so every info dict also carries `extra`"""
+    if on_progress is None:
+        return None
+    return lambda info, output: on_progress(dict(info, **extra), output)
+
+
+def _tile_spans(length, tile_size, overlap):
+    """[(start, end)] of equal tiles (at most tile_size) covering length, sharing >= overlap"""
+    if length <= tile_size:
+        return [(0, length)]
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    size = math.ceil((length + (count - 1) * overlap) / count)
+    starts = [round(i * (length - size) / (count - 1)) for i in range(count)]
+    return [(start, start + size) for start in starts]
+
+
+def _tile_ramp(start, end, length, overlap):
+    """1-D feather weights: ramps up/down over `overlap` px on edges shared with neighbours"""
+    ramp = torch.ones(end - start)
+    edge = min(overlap, end - start)
+    rising = (torch.arange(edge, dtype=torch.float32) + 0.5) / edge
+    if start > 0:
+        ramp[:edge] = torch.minimum(ramp[:edge], rising)
+    if end < length:
+        ramp[-edge:] = torch.minimum(ramp[-edge:], rising.flip(0))
+    return ramp
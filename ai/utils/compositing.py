@@ -0,0 +1,60 @@
+import functools
+
+import cv2
+import numpy as np
+
+
+@functools.lru_cache(maxsize=64)
+def feather_mask(height, width, ksize=15, sigma=10):
+    """(height, width, 1) float32 Gaussian-feathered blend mask, shared between calls
+
+    The array is read-only since every caller of the same size gets it.
+    """
+    mask = cv2.GaussianBlur(np.ones((height, width), dtype=np.float32), (ksize, ksize), sigma)
+    mask = mask[:, :, None]
+    mask.flags.writeable = False
+    return mask
+
+
+def blend_into(image, patch, bbox, mask=None):
+    """Blend patch into image[bbox] in place: roi + mask * (patch - roi)
+
+    Only the ROI is read and written, so the cost follows the patch size,
+    not the image size. Results are truncated to the image dtype.
+    """
+    x_min, y_min, x_max, y_max = bbox
+    roi = image[y_min:y_max, x_min:x_max]
+    if mask is None:
+        mask = feather_mask(y_max - y_min, x_max - x_min)
+
+    blended = roi.astype(np.float32)
+    blended += mask * (patch - blended)
+    np.copyto(roi, blended, casting="unsafe")
+    return image
+
+
+def polygon_roi(image, polygon):
+    """(bbox, local uint8 mask) of a polygon, clipped to the image; None if it is outside"""
+    height, width = image.shape[:2]
+    x, y, w, h = cv2.boundingRect(polygon)
+    x_min, y_min = max(0, x), max(0, y)
+    x_max, y_max = min(width, x + w), min(height, y + h)
+    if x_min >= x_max or y_min >= y_max:
+        return None
+
+    mask = np.zeros((y_max - y_min, x_max - x_min), dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon - np.array([x_min, y_min], dtype=polygon.dtype)], 255)
+    return (x_min, y_min, x_max, y_max), mask
+
+
+def scale_in_polygon(image, polygon, alpha, beta):
+    """In place, set pixels inside polygon to saturate(alpha * pixel + beta)"""
+    region = polygon_roi(image, polygon)
+    if region is None:
+        return image
+
+    (x_min, y_min, x_max, y_max), mask = region
+    roi = image[y_min:y_max, x_min:x_max]
+    enhanced = cv2.convertScaleAbs(roi, alpha=alpha, beta=beta)
+    np.copyto(roi, enhanced, where=(mask > 0)[:, :, None])
+    return image
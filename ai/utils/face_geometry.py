@@ -0,0 +1,98 @@
+import numpy as np
+
+# FaceMesh landmark indices of the regions the face operations use
+LEFT_EYE = [33, 246, 161, 160, 159, 158, 157, 173, 133, 155, 154, 153, 145, 144, 163, 7]
+RIGHT_EYE = [362, 398, 384, 385, 386, 387, 388, 466, 263, 249, 390, 373, 374, 380, 381, 382]
+LIPS = [61, 146, 91, 181, 84, 17, 314, 405, 321, 375, 291, 308, 324, 318, 402, 317, 14, 87, 178, 88, 95]
+FACE_OVAL = [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377,
+             152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
+
+DEFAULT_PADDING = 30
+# Landmarks per face with refine_landmarks=True (468 mesh points plus 10 iris points)
+NUM_LANDMARKS = 478
+
+
+class Face:
+    """Landmarks of one face in pixel coordinates, with cached boxes and polygons"""
+
+    def __init__(self, points, image_shape):
+        self.points = points
+        self.height, self.width = image_shape[:2]
+        self._bboxes = {}
+        self._polygons = {}
+
+    def bbox(self, padding=DEFAULT_PADDING):
+        """(x_min, y_min, x_max, y_max) around all landmarks, padded and clipped to the image"""
+        bbox = self._bboxes.get(padding)
+        if bbox is None:
+            x_min, y_min = self.points[:, :2].min(axis=0).astype(int)
+            x_max, y_max = self.points[:, :2].max(axis=0).astype(int)
+            bbox = (max(0, int(x_min) - padding), max(0, int(y_min) - padding),
+                    min(self.width, int(x_max) + padding), min(self.height, int(y_max) + padding))
+            self._bboxes[padding] = bbox
+        return bbox
+
+    def polygon(self, indices):
+        """(K, 2) int32 polygon through the given landmarks, as cv2.fillPoly expects"""
+        key = tuple(indices)
+        polygon = self._polygons.get(key)
+        if polygon is None:
+            polygon = self.points[list(key), :2].astype(np.int32)
+            self._polygons[key] = polygon
+        return polygon
+
+    @property
+    def left_eye(self):
+        return self.polygon(LEFT_EYE)
+
+    @property
+    def right_eye(self):
+        return self.polygon(RIGHT_EYE)
+
+    @property
+    def lips(self):
+        return self.polygon(LIPS)
+
+    @property
+    def face_oval(self):
+        return self.polygon(FACE_OVAL)
+
+
+class FaceLandmarks:
+    """All faces of a frame as one (N, 478, 3) float32 array in pixel coordinates
+
+    x and y are pixels; z uses the x scale, as FaceMesh reports it relative
+    to the image width. Indexing or iterating yields Face views that share
+    the array.
+    """
+
+    def __init__(self, points, image_shape):
+        self.points = points
+        self.image_shape = image_shape[:2]
+        self._faces = [Face(face_points, self.image_shape) for face_points in points]
+
+    @classmethod
+    def from_mediapipe(cls, multi_face_landmarks, image_shape):
+        """Convert FaceMesh's multi_face_landmarks once; None or [] gives no faces"""
+        height, width = image_shape[:2]
+        faces = multi_face_landmarks or []
+        if not faces:
+            return cls.empty(image_shape)
+        points = np.array([[(landmark.x, landmark.y, landmark.z) for landmark in face.landmark]
+                           for face in faces], dtype=np.float32).reshape(len(faces), -1, 3)
+        points *= np.array([width, height, width], dtype=np.float32)
+        return cls(points, image_shape)
+
+    @classmethod
+    def empty(cls, image_shape):
+        """No faces; an empty array can't be reshaped with an inferred axis"""
+        return cls(np.zeros((0, NUM_LANDMARKS, 3), dtype=np.float32), image_shape)
+
+    def __len__(self):
+        return len(self._faces)
+
+    def __iter__(self):
+        return iter(self._faces)
+
+    def __getitem__(self, index):
+        return self._faces[index]
@@ -0,0 +1,36 @@
+import io
+import os
+from PIL import Image
+
+SUPPORTED_FORMATS = ("JPEG", "PNG", "WEBP")
+
+def read_upload(file, mode=None, formats=SUPPORTED_FORMATS):
+    """Decode an uploaded file straight from the request stream, without touching disk"""
+    image = Image.open(file.stream)
+    if formats and image.format not in formats:
+        raise ValueError(f"Unsupported image format: {image.format}")
+
+    # Force decoding now, while the request stream is still open
+    image.load()
+    if mode and image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+def output_format(filename, default="PNG"):
+    """Pick the PIL format matching the filename extension"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    return Image.registered_extensions().get(extension, default)
+
+def encode_image(image, fmt, quality=95):
+    """Encode an image to bytes with format-specific settings"""
+    if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        image.save(buffer, "JPEG", quality=quality, optimize=True, subsampling=0)
+    elif fmt == "PNG":
+        image.save(buffer, "PNG", optimize=True, compress_level=6)
+    else:
+        image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()